@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+from api.models import ConfigProcessRead
+from api.storage import directory_size, read_columns, write_columns
+from src import processors
+
+CACHE_DIR = "./data/cache"
+CACHE_BYTES = int(os.getenv("RESULT_CACHE_BYTES", 2 * 1024**3))
+
+
+def file_signature(path: str) -> List[Any]:
+    stat = os.stat(path)
+    return [path, stat.st_size, stat.st_mtime_ns]
+
+
+def normalize_config(config: ConfigProcessRead, axes: bool = False) -> Dict[str, Any]:
+    # Only what changes the processed table is part of the key: thresholds of
+    # unselected variables, units and file lists are ignored, axes only matter
+    # to the decimation grid or when asked for (spatial structures built on it)
+    decimation = [
+        config.decimation,
+        config.decimation_cells,
+        config.decimation_cap,
+        config.target_points,
+    ]
+    if axes or config.decimation != "none":
+        # Resolved over every variable: FITS columns are there even unselected
+        decimation.append(processors.spatial_columns(list(config.variables), config))
+    return {
+        "downsampling": config.downsampling,
+        "seed": config.seed,
+        "deduplicate": config.deduplicate,
+        "decimation": decimation,
+        "variables": {
+            var_name: [var_config.thr_min_sel, var_config.thr_max_sel]
+            for var_name, var_config in sorted(config.variables.items())
+            if var_config.selected
+        },
+    }
+
+
+class ResultCache:
+    """On-disk LRU cache of processed results, keyed by input files and config
+
+    The job workers share the cache directory, so there is no in-memory index:
+    the metadata files are scanned on every put and the byte budget holds for
+    all processes together.
+    """
+
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def key(
+        self, paths: List[str], config: ConfigProcessRead, axes: bool = False
+    ) -> str:
+        payload = {
+            "files": [file_signature(path) for path in paths],
+            "config": normalize_config(config, axes),
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        try:
+            # Keep the LRU order across processes and restarts
+            os.utime(self._meta_path(key))
+            # Copy-on-write mapping: nothing is parsed and callers may still modify it
+            df = read_columns(self._data_path(key), mmap_mode="c")
+        except (OSError, ValueError):
+            # Not cached, or evicted by another process meanwhile
+            df = None
+        with self._lock:
+            if df is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return df
+
+    def put(self, key: str, paths: List[str], df: pd.DataFrame) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        write_columns(df, self._data_path(key))
+        meta = {
+            "paths": sorted(paths),
+            "files": sorted(file_signature(path) for path in paths),
+            "bytes": directory_size(self._data_path(key)),
+        }
+        # Renamed into place, scans never see a partial metadata file
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(meta, f)
+        os.replace(temp_path, self._meta_path(key))
+
+        with self._lock:
+            entries = self._scan()
+            # Results computed from older versions of the same files are stale
+            for old_key, old_meta in list(entries.items()):
+                if (
+                    old_key != key
+                    and old_meta["paths"] == meta["paths"]
+                    and old_meta["files"] != meta["files"]
+                ):
+                    self._remove(old_key)
+                    del entries[old_key]
+            self._evict(entries, key)
+
+    def stats(self) -> Dict[str, Any]:
+        entries = self._scan()
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(entries),
+                "bytes": sum(meta["bytes"] for meta in entries.values()),
+                "max_bytes": self.max_bytes,
+            }
+
+    def _scan(self) -> OrderedDict:
+        # Entries of every process, from their metadata files, oldest access first
+        metas = []
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if not name.endswith(".json"):
+                    continue
+                key = name[: -len(".json")]
+                try:
+                    with open(self._meta_path(key)) as f:
+                        meta = json.load(f)
+                    mtime = os.path.getmtime(self._meta_path(key))
+                except (OSError, ValueError):
+                    continue
+                if os.path.exists(self._data_path(key)):
+                    metas.append((mtime, key, meta))
+        metas.sort(key=lambda item: item[0])
+        return OrderedDict((key, meta) for _, key, meta in metas)
+
+    def _evict(self, entries: OrderedDict, keep: str) -> None:
+        # The entry just written is kept even when it is over the budget alone
+        total = sum(meta["bytes"] for meta in entries.values())
+        for key, meta in entries.items():
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            self._remove(key)
+            total -= meta["bytes"]
+
+    def _remove(self, key: str) -> None:
+        # Another process may be removing the same entry
+        try:
+            os.remove(self._meta_path(key))
+        except FileNotFoundError:
+            pass
+        shutil.rmtree(self._data_path(key), ignore_errors=True)
+
+    def _data_path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+
+result_cache = ResultCache()
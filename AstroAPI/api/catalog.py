@@ -0,0 +1,101 @@
+import os
+from typing import Dict
+
+import numpy as np
+from sqlmodel import Session, delete, insert, select
+
+from api.db import engine
+from api.metrics import measure
+from api.models import (
+    VariableConfigRead,
+    VariableHistogram,
+    VariableStatistics,
+    VariableStatisticsBase,
+)
+from src import gets
+from src.histograms import Histogram
+
+
+def _fresh(rows, stat: os.stat_result) -> bool:
+    return bool(rows) and all(
+        row.size == stat.st_size and row.mtime == stat.st_mtime_ns for row in rows
+    )
+
+
+class StatisticsCatalog:
+    """Per-file variable statistics and histograms, computed together and
+    recomputed only when a file's size or mtime changes"""
+
+    def get_statistics(self, path: str) -> Dict[str, VariableStatisticsBase]:
+        stat = os.stat(path)
+        with Session(engine) as session:
+            rows = session.exec(
+                select(VariableStatistics).where(VariableStatistics.path == path)
+            ).all()
+            if _fresh(rows, stat):
+                return {
+                    row.var_name: VariableStatisticsBase.model_validate(row)
+                    for row in rows
+                }
+            return self._refresh(session, path, stat)[0]
+
+    def get_histograms(self, path: str) -> Dict[str, Histogram]:
+        stat = os.stat(path)
+        with Session(engine) as session:
+            rows = session.exec(
+                select(VariableHistogram).where(VariableHistogram.path == path)
+            ).all()
+            if _fresh(rows, stat):
+                return {
+                    row.var_name: (
+                        row.bin_min,
+                        row.bin_max,
+                        np.frombuffer(row.counts, dtype=np.int64),
+                    )
+                    for row in rows
+                }
+            return self._refresh(session, path, stat)[1]
+
+    def _refresh(self, session: Session, path: str, stat: os.stat_result):
+        with measure("statistics") as record:
+            statistics, histograms = gets.getDistributions(path)
+            record.rows_out = max((s.count for s in statistics.values()), default=0)
+            record.bytes = stat.st_size
+
+        version = {"path": path, "size": stat.st_size, "mtime": stat.st_mtime_ns}
+        session.exec(delete(VariableStatistics).where(VariableStatistics.path == path))
+        session.exec(delete(VariableHistogram).where(VariableHistogram.path == path))
+        if statistics:
+            session.exec(
+                insert(VariableStatistics),
+                params=[
+                    {**version, **stats.model_dump()} for stats in statistics.values()
+                ],
+            )
+        if histograms:
+            session.exec(
+                insert(VariableHistogram),
+                params=[
+                    {
+                        **version,
+                        "var_name": name,
+                        "bin_min": bin_min,
+                        "bin_max": bin_max,
+                        "counts": counts.astype(np.int64).tobytes(),
+                    }
+                    for name, (bin_min, bin_max, counts) in histograms.items()
+                ],
+            )
+        session.commit()
+        return statistics, histograms
+
+    def get_thresholds(self, path: str) -> Dict[str, VariableConfigRead]:
+        return {
+            key: VariableConfigRead(
+                thr_min=stats.thr_min, thr_max=stats.thr_max, unit=stats.unit
+            )
+            for key, stats in self.get_statistics(path).items()
+        }
+
+
+statistics_catalog = StatisticsCatalog()
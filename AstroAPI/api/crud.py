@@ -1,12 +1,14 @@
 from datetime import datetime
-from typing import List
+from typing import Dict, List, Optional
 
-from sqlmodel import delete, select
+from sqlalchemy.orm import selectinload
+from sqlmodel import delete, insert, select
 
 from api.db import SessionDep
 from api.exceptions import (
     ConfigProcessNotFoundError,
     DataProcessingError,
+    FileScanError,
     ProjectNotFoundError,
 )
 from api.models import (
@@ -33,38 +35,72 @@ class CRUDConfigProcess:
     def get_config_process(self, db: SessionDep, project_id: int) -> ConfigProcessRead:
         return self._build_config_process_read(db, project_id)
 
-    def create_config_process(
-        self, db: SessionDep, config_create: ConfigProcessCreate, project_id: int
-    ) -> ConfigProcess:
-        config = ConfigProcess.model_validate(config_create)
-        config.project_id = project_id
-        db.add(config)
-        db.commit()
-        db.refresh(config)
-        return config
-
-    def delete_config_process(self, db: SessionDep, project_id: int):
-        config_processes = db.exec(
-            select(ConfigProcess).where(ConfigProcess.project_id == project_id)
+    def create_config_processes(
+        self,
+        db: SessionDep,
+        project_id: int,
+        confs: Dict[str, Dict[str, ConfigProcessCreate]],
+        files: Dict[str, File],
+    ) -> None:
+        # Batched inserts in the caller's transaction, the caller commits. ORM
+        # objects would be inserted one at a time to get their ids back, so
+        # they're read afterwards: ids follow the insertion order.
+        rows = [
+            (path, {**conf.model_dump(), "project_id": project_id})
+            for path, vars in confs.items()
+            for conf in vars.values()
+        ]
+        if not rows:
+            return
+        db.exec(insert(ConfigProcess), params=[row for _, row in rows])
+        ids = db.exec(
+            select(ConfigProcess.id)
+            .where(ConfigProcess.project_id == project_id)
+            .order_by(ConfigProcess.id)
         ).all()
-        for config_process in config_processes:
-            db.delete(config_process)
-        db.commit()
+        db.exec(
+            insert(ConfigFileLink),
+            params=[
+                {"config_id": config_id, "file_id": files[path].id}
+                for config_id, (path, _) in zip(ids, rows)
+            ],
+        )
 
-    def associate_config_file(self, db: SessionDep, config_id: int, file_path: str):
-        file = db.exec(select(File).where(File.path == file_path)).first()
-        link = ConfigFileLink(config_id=config_id, file_id=file.id)
-        db.add(link)
-        db.commit()
+    def delete_config_process(self, db: SessionDep, project_id: int):
+        # Left uncommitted, it's always followed by the new configs
+        config_ids = select(ConfigProcess.id).where(
+            ConfigProcess.project_id == project_id
+        )
+        db.exec(delete(ConfigFileLink).where(ConfigFileLink.config_id.in_(config_ids)))
+        db.exec(delete(ConfigProcess).where(ConfigProcess.project_id == project_id))
 
     def _build_config_process_read(
         self, db: SessionDep, project_id: int
     ) -> ConfigProcessRead:
+        return self.get_config_processes(db, [project_id])[project_id]
 
+    def get_config_processes(
+        self, db: SessionDep, project_ids: List[int]
+    ) -> Dict[int, ConfigProcessRead]:
+        # Two queries whatever the number of projects: configs, then their files
         config_processes = db.exec(
-            select(ConfigProcess).where(ConfigProcess.project_id == project_id)
+            select(ConfigProcess)
+            .where(ConfigProcess.project_id.in_(project_ids))
+            .options(selectinload(ConfigProcess.files))
+            .order_by(ConfigProcess.id)
         ).all()
 
+        by_project = {project_id: [] for project_id in project_ids}
+        for config in config_processes:
+            by_project[config.project_id].append(config)
+        return {
+            project_id: self._merge_config_processes(configs)
+            for project_id, configs in by_project.items()
+        }
+
+    def _merge_config_processes(
+        self, config_processes: List[ConfigProcess]
+    ) -> ConfigProcessRead:
         variables = {}
         for config in config_processes:
             if config.var_name not in variables:
@@ -89,44 +125,75 @@ class CRUDConfigProcess:
 crud_config_process = CRUDConfigProcess()
 
 
-def update_project_paths(
-    db: SessionDep, project: Project, project_paths: List[str]
-) -> None:
-    ids = db.exec(
-        select(ProjectFileLink.file_id).where(ProjectFileLink.project_id == project.id)
-    ).all()
-    current_paths = {
-        file.path for file in db.exec(select(File).where(File.id.in_(ids))).all()
+def resolve_files(db: SessionDep, paths: List[str]) -> Dict[str, File]:
+    # One query for the known paths, the missing ones are added to the session
+    # and inserted in a batch by the next flush
+    files = {
+        file.path: file
+        for file in db.exec(select(File).where(File.path.in_(paths))).all()
     }
-    new_paths = set(project_paths)
-
-    paths_to_delete = current_paths - new_paths
-    paths_to_create = new_paths - current_paths
-    if paths_to_delete:
-        db.exec(delete(File).where(File.path.in_(paths_to_delete)))
-        db.exec(delete(ProjectFileLink).where(ProjectFileLink.file_id.in_(ids)))
-        db.commit()
+    missing = [File(path=path) for path in dict.fromkeys(paths) if path not in files]
+    db.add_all(missing)
+    files.update((file.path, file) for file in missing)
+    return files
 
-    for path in paths_to_create:
-        file = File(path=path)
-        db.add(file)
-        db.commit()
-        db.refresh(file)
-        link = ProjectFileLink(project_id=project.id, file_id=file.id)
-        db.add(link)
 
+def read_project_data(
+    files: List[File], context: Dict
+) -> Dict[str, Dict[str, ConfigProcessCreate]]:
+    # Called before anything is flushed: the statistics catalog writes to the
+    # database from the scanning threads and would wait on our transaction
     try:
-        confs = data_processor.read_data(project.files)
+        return data_processor.read_data(files)
+    except FileScanError:
+        raise
     except Exception as e:
         raise DataProcessingError(
             f"Failed to read data from project files: {str(e)}",
-            {"project_id": project.id, "file_count": len(project.files)},
+            {**context, "file_count": len(files)},
+        )
+
+
+def update_project_paths(
+    db: SessionDep, project: Project, project_paths: List[str]
+) -> None:
+    # Everything is written in a single transaction, nothing changes if a file
+    # can't be read
+    current_files = {
+        file.path: file
+        for file in db.exec(
+            select(File)
+            .join(ProjectFileLink)
+            .where(ProjectFileLink.project_id == project.id)
+        ).all()
+    }
+    new_paths = list(dict.fromkeys(project_paths))
+    files = resolve_files(db, new_paths)
+    confs = read_project_data(
+        [files[path] for path in new_paths], {"project_id": project.id}
+    )
+
+    paths_to_delete = set(current_files) - set(new_paths)
+    if paths_to_delete:
+        db.exec(
+            delete(ProjectFileLink).where(
+                ProjectFileLink.project_id == project.id,
+                ProjectFileLink.file_id.in_(
+                    [current_files[path].id for path in paths_to_delete]
+                ),
+            )
         )
+        db.exec(delete(File).where(File.path.in_(paths_to_delete)))
+
+    db.flush()
+    db.add_all(
+        ProjectFileLink(project_id=project.id, file_id=files[path].id)
+        for path in new_paths
+        if path not in current_files
+    )
     crud_config_process.delete_config_process(db, project.id)
-    for file, vars in confs.items():
-        for var_name, conf in vars.items():
-            conf_db = crud_config_process.create_config_process(db, conf, project.id)
-            crud_config_process.associate_config_file(db, conf_db.id, file)
+    crud_config_process.create_config_processes(db, project.id, confs, files)
+    db.commit()
 
 
 def update_project_config(
@@ -155,30 +222,53 @@ def update_project_config(
 
 
 class CRUDProject:
-    def get_projects(self, db: SessionDep) -> List[ProjectRead]:
-        projects = db.exec(select(Project)).all()
+    def get_projects(
+        self,
+        db: SessionDep,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        summary: bool = False,
+    ) -> List[ProjectRead]:
+        # Files are loaded with the page of projects and configs in one batch,
+        # summaries leave config_process out
+        projects = db.exec(
+            select(Project)
+            .options(selectinload(Project.files))
+            .order_by(Project.id)
+            .offset(offset)
+            .limit(limit)
+        ).all()
+        config_processes = (
+            {}
+            if summary
+            else crud_config_process.get_config_processes(
+                db, [project.id for project in projects]
+            )
+        )
         project_reads = []
         for project in projects:
-            config_process = crud_config_process.get_config_process(db, project.id)
             project_read = ProjectRead.model_validate(project)
             project_read.paths = [file.path for file in project.files]
-            project_read.config_process = config_process
+            project_read.config_process = config_processes.get(project.id)
             project_reads.append(project_read)
         return project_reads
 
     def create_project(self, db: SessionDep, project_create: ProjectCreate) -> Project:
+        # Project, files, links and configs are committed together
         project = Project.model_validate(project_create)
-        db.add(project)
+        paths = list(dict.fromkeys(project_create.paths))
+        files = resolve_files(db, paths)
+        confs = read_project_data(
+            [files[path] for path in paths], {"project_name": project.name}
+        )
 
-        for path in project_create.paths:
-            file = db.exec(select(File).where(File.path == path)).first()
-            if not file:
-                file = File(path=path)
-                db.add(file)
-                db.commit()
-                db.refresh(file)
-            link = ProjectFileLink(project_id=project.id, file_id=file.id)
-            db.add(link)
+        db.add(project)
+        db.flush()
+        db.add_all(
+            ProjectFileLink(project_id=project.id, file_id=files[path].id)
+            for path in paths
+        )
+        crud_config_process.create_config_processes(db, project.id, confs, files)
 
         db.commit()
         db.refresh(project)
@@ -1,6 +1,7 @@
 import logging
 
 from fastapi import Request, status
+from fastapi.encoders import jsonable_encoder
 from fastapi.responses import JSONResponse
 from pydantic import ValidationError
 from sqlalchemy.exc import SQLAlchemyError
@@ -64,7 +65,12 @@ async def pydantic_validation_exception_handler(
             "error": {
                 "code": "VALIDATION_ERROR",
                 "message": "Request validation failed",
-                "context": {"details": exc.errors()},
+                # Errors raised by model validators are kept as their message
+                "context": {
+                    "details": jsonable_encoder(
+                        exc.errors(), custom_encoder={Exception: str}
+                    )
+                },
             }
         },
     )
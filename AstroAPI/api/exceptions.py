@@ -38,6 +38,56 @@ class ConfigProcessNotFoundError(APIException):
         )
 
 
+class VariableNotFoundError(APIException):
+    def __init__(self, project_id: int, var_names: List[str]):
+        super().__init__(
+            status_code=404,
+            detail=f"Variables {var_names} not found in the files of project {project_id}",
+            error_code="VARIABLE_NOT_FOUND",
+            context={"project_id": project_id, "var_names": var_names},
+        )
+
+
+class LODNotFoundError(APIException):
+    def __init__(self, project_id: int):
+        super().__init__(
+            status_code=404,
+            detail=f"No level-of-detail pyramid built for project {project_id} with this configuration",
+            error_code="LOD_NOT_FOUND",
+            context={"project_id": project_id},
+        )
+
+
+class JobNotFoundError(APIException):
+    def __init__(self, job_id: str):
+        super().__init__(
+            status_code=404,
+            detail=f"Job with id {job_id} not found",
+            error_code="JOB_NOT_FOUND",
+            context={"job_id": job_id},
+        )
+
+
+class JobNotFinishedError(APIException):
+    def __init__(self, job_id: str, status: str):
+        super().__init__(
+            status_code=409,
+            detail=f"Job {job_id} has no result, its status is '{status}'",
+            error_code="JOB_NOT_FINISHED",
+            context={"job_id": job_id, "status": status},
+        )
+
+
+class JobResultExpiredError(APIException):
+    def __init__(self, job_id: str):
+        super().__init__(
+            status_code=410,
+            detail=f"The result of job {job_id} was evicted from the cache",
+            error_code="JOB_RESULT_EXPIRED",
+            context={"job_id": job_id},
+        )
+
+
 class DataProcessingError(APIException):
     def __init__(self, detail: str, context: Optional[Dict[str, Any]] = None):
         super().__init__(
@@ -48,6 +98,16 @@ class DataProcessingError(APIException):
         )
 
 
+class FileScanError(APIException):
+    def __init__(self, errors: Dict[str, str]):
+        super().__init__(
+            status_code=422,
+            detail=f"Failed to read {len(errors)} file(s): {', '.join(errors)}",
+            error_code="FILE_SCAN_ERROR",
+            context={"errors": errors},
+        )
+
+
 class InvalidFileExtensionError(APIException):
     def __init__(self, invalid_files: List[str], allowed_extensions: List[str]):
         super().__init__(
@@ -0,0 +1,169 @@
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from api.cache import result_cache
+from api.models import ConfigProcessRead, JobRead
+from api.utils import DataProcessor
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", min(4, os.cpu_count() or 1)))
+# Finished jobs are forgotten after this many seconds
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", 3600))
+
+
+class JobCancelledError(Exception):
+    pass
+
+
+def run_process_job(
+    job_id: str, pid: int, paths: List[str], config_json: str, stage: str, state
+) -> str:
+    # Runs in a worker process: progress and cancellation go through the shared
+    # state dict owned by the manager process. The result is the one stored in
+    # the result cache, its key is returned.
+    def report(stage: str, done: int, total: int) -> None:
+        if state.get(f"{job_id}:cancel"):
+            raise JobCancelledError(job_id)
+        state[job_id] = {"stage": stage, "done": done, "total": total}
+
+    config = ConfigProcessRead.model_validate_json(config_json)
+    key = result_cache.key(paths, config)
+    DataProcessor.process_data(pid, paths, config, progress=report, stage=stage)
+    report("done", 1, 1)
+    return key
+
+
+class JobManager:
+    """Runs processing jobs in a bounded pool of worker processes"""
+
+    def __init__(
+        self, max_workers: int = JOB_WORKERS, retention: int = JOB_RETENTION_SECONDS
+    ):
+        self.max_workers = max_workers
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._manager = None
+        self._state = None
+        self._jobs: Dict[str, JobRead] = {}
+        self._futures: Dict[str, Future] = {}
+        # Monotonic time at which each job finished
+        self._finished: Dict[str, float] = {}
+
+    def submit(
+        self,
+        pid: int,
+        paths: List[str],
+        config: ConfigProcessRead,
+        stage: str = "load",
+    ) -> JobRead:
+        with self._lock:
+            self._start()
+            self._expire()
+            job = JobRead(id=uuid.uuid4().hex, project_id=pid, status="queued")
+            self._jobs[job.id] = job
+            self._futures[job.id] = self._executor.submit(
+                run_process_job,
+                job.id,
+                pid,
+                paths,
+                config.model_dump_json(),
+                stage,
+                self._state,
+            )
+            # Runs in the executor thread, or right away if the job already ended
+            self._futures[job.id].add_done_callback(
+                lambda future, job_id=job.id: self._finished.setdefault(
+                    job_id, time.monotonic()
+                )
+            )
+        return job
+
+    def get(self, job_id: str) -> Optional[JobRead]:
+        with self._lock:
+            self._expire()
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            future = self._futures[job_id]
+            progress = self._state.get(job_id) or {}
+            job.stage = progress.get("stage", job.stage)
+            job.done = progress.get("done", job.done)
+            job.total = progress.get("total", job.total)
+
+            if job.status in ("done", "failed", "cancelled"):
+                return job
+            if future.cancelled():
+                job.status = "cancelled"
+            elif future.done():
+                error = future.exception()
+                if error is None:
+                    job.status = "done"
+                elif isinstance(error, JobCancelledError):
+                    job.status = "cancelled"
+                else:
+                    job.status = "failed"
+                    job.error = str(error)
+            elif future.running() or progress:
+                job.status = "running"
+            return job
+
+    def cancel(self, job_id: str) -> Optional[JobRead]:
+        with self._lock:
+            future = self._futures.get(job_id)
+            if future is None:
+                return None
+            # Queued jobs never start, running ones stop at their next progress report
+            if not future.cancel():
+                self._state[f"{job_id}:cancel"] = True
+        return self.get(job_id)
+
+    def remove(self, job_id: str) -> None:
+        with self._lock:
+            self._forget(job_id)
+
+    def result(self, job_id: str) -> Optional[pd.DataFrame]:
+        # None once the job expired or its result was evicted from the cache
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is None:
+            return None
+        return result_cache.get(future.result())
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._manager.shutdown()
+                self._executor = self._manager = self._state = None
+
+    def _forget(self, job_id: str) -> None:
+        self._jobs.pop(job_id, None)
+        self._futures.pop(job_id, None)
+        self._finished.pop(job_id, None)
+        if self._state is not None:
+            self._state.pop(job_id, None)
+            self._state.pop(f"{job_id}:cancel", None)
+
+    def _expire(self) -> None:
+        deadline = time.monotonic() - self.retention
+        for job_id, finished in list(self._finished.items()):
+            if finished < deadline:
+                self._forget(job_id)
+
+    def _start(self) -> None:
+        # Started on first use; spawned workers don't inherit the server's threads
+        if self._executor is None:
+            context = multiprocessing.get_context("spawn")
+            self._manager = context.Manager()
+            self._state = self._manager.dict()
+            self._executor = ProcessPoolExecutor(self.max_workers, mp_context=context)
+
+
+job_manager = JobManager()
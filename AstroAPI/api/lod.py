@@ -0,0 +1,215 @@
+import json
+import os
+import shutil
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from api.storage import read_columns, replace_directory, temp_directory, write_columns
+
+LOD_DIR = "./data/lod"
+# Points kept per octree node on every level but the last one
+LOD_POINTS_PER_NODE = int(os.getenv("LOD_POINTS_PER_NODE", 4096))
+LOD_MAX_LEVELS = 12
+# Pyramids on disk beyond this are removed, least recently read first
+LOD_CACHE_BYTES = int(os.getenv("LOD_CACHE_BYTES", 2 * 1024**3))
+
+META_FILE = "meta.json"
+
+
+def _cell_coords(
+    positions: np.ndarray, low: np.ndarray, high: np.ndarray, cells: int
+) -> np.ndarray:
+    extent = np.where(high > low, high - low, 1.0)
+    coords = ((positions - low) / extent * cells).astype(np.int64)
+    return np.clip(coords, 0, cells - 1)
+
+
+class LODStore:
+    """Octree level-of-detail pyramids of processed results, one directory per key
+
+    Level n splits the bounding box in 2^n cells per axis and keeps at most
+    points_per_node random points per cell, sorted by cell. The last level holds
+    every point.
+    """
+
+    def __init__(
+        self,
+        directory: str = LOD_DIR,
+        points_per_node: int = LOD_POINTS_PER_NODE,
+        max_bytes: int = LOD_CACHE_BYTES,
+    ):
+        self.directory = directory
+        self.points_per_node = points_per_node
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def build(
+        self,
+        key: str,
+        df: pd.DataFrame,
+        columns: List[str],
+        rng: Optional[np.random.Generator] = None,
+    ) -> Dict[str, Any]:
+        rng = rng if rng is not None else np.random.default_rng()
+        positions = df[columns].to_numpy(dtype=float)
+        low, high = positions.min(axis=0), positions.max(axis=0)
+
+        tmp_path = temp_directory(self._path(key))
+
+        try:
+            # Shuffled once: the first points of each cell are a random subset of it
+            order = rng.permutation(len(df))
+            levels = []
+            for level in range(LOD_MAX_LEVELS):
+                cells = 2**level
+                coords = _cell_coords(positions[order], low, high, cells)
+                flat = np.ravel_multi_index(coords.T, (cells,) * len(columns))
+
+                by_cell = np.argsort(flat, kind="stable")
+                sorted_cells = flat[by_cell]
+                starts = np.flatnonzero(
+                    np.r_[True, sorted_cells[1:] != sorted_cells[:-1]]
+                )
+                counts = np.diff(np.r_[starts, len(flat)])
+                rank = np.arange(len(flat)) - np.repeat(starts, counts)
+
+                last = (
+                    level == LOD_MAX_LEVELS - 1 or counts.max() <= self.points_per_node
+                )
+                kept = by_cell if last else by_cell[rank < self.points_per_node]
+                kept_counts = (
+                    counts if last else np.minimum(counts, self.points_per_node)
+                )
+
+                level_path = os.path.join(tmp_path, f"level_{level}")
+                write_columns(df.iloc[order[kept]], level_path)
+                np.save(
+                    os.path.join(level_path, "nodes.npy"),
+                    np.stack(
+                        [
+                            sorted_cells[starts],
+                            np.r_[0, np.cumsum(kept_counts)[:-1]],
+                            kept_counts,
+                        ],
+                        axis=1,
+                    ),
+                )
+                levels.append(
+                    {"level": level, "nodes": len(starts), "points": len(kept)}
+                )
+                if last:
+                    break
+
+            meta = {
+                "columns": columns,
+                "low": low.tolist(),
+                "high": high.tolist(),
+                "points_per_node": self.points_per_node,
+                "levels": levels,
+                "bytes": _tree_size(tmp_path),
+            }
+            with open(os.path.join(tmp_path, META_FILE), "w") as f:
+                json.dump(meta, f)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+        replace_directory(tmp_path, self._path(key))
+        self.evict(key)
+        return meta
+
+    def meta(self, key: str) -> Dict[str, Any]:
+        with open(os.path.join(self._path(key), META_FILE)) as f:
+            return json.load(f)
+
+    def read_level(
+        self, key: str, level: int, planes: Optional[List[List[float]]] = None
+    ) -> Optional[pd.DataFrame]:
+        """Points of a level, only from the nodes intersecting the planes if given
+
+        Planes are (a, b, c, d) with normals pointing inside the frustum, a point p
+        is inside when a*p0 + b*p1 + c*p2 + d >= 0 for every plane. None once the
+        pyramid has been evicted.
+        """
+        try:
+            # Keep the LRU order across processes and restarts
+            os.utime(os.path.join(self._path(key), META_FILE))
+            meta = self.meta(key)
+            level = min(level, len(meta["levels"]) - 1)
+            level_path = os.path.join(self._path(key), f"level_{level}")
+            df = read_columns(level_path)
+            if planes is None:
+                return df
+            nodes = np.load(os.path.join(level_path, "nodes.npy"))
+        except FileNotFoundError:
+            return None
+
+        cells = 2**level
+        dims = len(meta["columns"])
+        low, high = np.array(meta["low"]), np.array(meta["high"])
+        size = (high - low) / cells
+
+        coords = np.stack(np.unravel_index(nodes[:, 0], (cells,) * dims), axis=1)
+        box_min = low + coords * size
+        box_max = box_min + size
+
+        # A box is outside as soon as its corner furthest along a plane normal is
+        # behind that plane
+        planes = np.asarray(planes, dtype=float)
+        if planes.ndim != 2 or planes.shape[1] != dims + 1:
+            raise ValueError(f"Frustum planes must have {dims + 1} coefficients")
+        normals, offsets = planes[:, :dims], planes[:, dims]
+        corners = np.where(normals[None] >= 0, box_max[:, None], box_min[:, None])
+        visible = ((corners * normals[None]).sum(axis=2) + offsets >= 0).all(axis=1)
+
+        # Row ranges of the visible nodes, concatenated
+        offsets, counts = nodes[visible, 1], nodes[visible, 2]
+        rows = np.arange(counts.sum()) + np.repeat(
+            offsets - np.r_[0, np.cumsum(counts)[:-1]], counts
+        )
+        return df.iloc[rows]
+
+    def evict(self, keep: str) -> None:
+        # Pyramids of every process, scanned from disk; the one just built is
+        # kept even when it is over the budget alone
+        pyramids = []
+        if os.path.isdir(self.directory):
+            for key in os.listdir(self.directory):
+                # Pyramids being built live in "<key>.<suffix>" directories
+                if "." in key:
+                    continue
+                meta_path = os.path.join(self._path(key), META_FILE)
+                try:
+                    with open(meta_path) as f:
+                        nbytes = json.load(f).get("bytes", 0)
+                    mtime = os.path.getmtime(meta_path)
+                except (OSError, ValueError):
+                    continue
+                pyramids.append((mtime, key, nbytes))
+
+        with self._lock:
+            total = sum(nbytes for _, _, nbytes in pyramids)
+            for _, key, nbytes in sorted(pyramids):
+                if total <= self.max_bytes:
+                    break
+                if key == keep:
+                    continue
+                shutil.rmtree(self._path(key), ignore_errors=True)
+                total -= nbytes
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+
+def _tree_size(directory: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(directory)
+        for name in names
+    )
+
+
+lod_store = LODStore()
@@ -1,24 +1,38 @@
+import time
 from contextlib import asynccontextmanager
 
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.exceptions import RequestValidationError
+from fastapi.responses import PlainTextResponse
 from sqlalchemy.exc import SQLAlchemyError
 
-from api.db import create_db_and_tables
+from api.cache import result_cache
+from api.db import async_engine, create_db_and_tables
 from api.error_handlers import (
     api_exception_handler,
     pydantic_validation_exception_handler,
     sqlalchemy_exception_handler,
 )
 from api.exceptions import APIException
+from api.jobs import job_manager
+from api.metrics import metrics, request_timings, server_timing
+from api.routes.jobs import router as jobs_router
 from api.routes.projects import router as projects_router
+from api.startup import startup_report
+from src.handles import handle_cache
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    create_db_and_tables()
+    startup_report.begin()
+    with startup_report.phase("database"):
+        create_db_and_tables()
+    startup_report.ready()
+    startup_report.start_warm_up()
     yield
+    job_manager.shutdown()
+    await async_engine.dispose()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -28,12 +42,50 @@ app.add_exception_handler(SQLAlchemyError, sqlalchemy_exception_handler)
 app.add_exception_handler(RequestValidationError, pydantic_validation_exception_handler)
 
 
+@app.middleware("http")
+async def add_server_timing(request: Request, call_next):
+    # Stages measured while handling the request are reported with its response
+    timings = []
+    token = request_timings.set(timings)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        request_timings.reset(token)
+    timings.append(("total", time.perf_counter() - start))
+    response.headers["Server-Timing"] = server_timing(timings)
+    return response
+
+
 @app.get("/api/health")
 def health():
     return {"status": "OK"}
 
 
+@app.get("/api/metrics", response_class=PlainTextResponse)
+def read_metrics():
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.get("/api/startup")
+def startup_stats():
+    return startup_report.as_dict()
+
+
+@app.get("/api/cache")
+def cache_stats():
+    return result_cache.stats()
+
+
+@app.get("/api/cache/handles")
+def handle_cache_stats():
+    return handle_cache.stats()
+
+
 app.include_router(projects_router, prefix="/api")
+app.include_router(jobs_router, prefix="/api")
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,177 @@
+import mmap
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Stages timed during the current request, for its Server-Timing header
+request_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar(
+    "request_timings", default=None
+)
+
+
+def peak_rss() -> int:
+    # Highest resident memory over the lifetime of the process
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def current_rss() -> int:
+    # Resident memory of the process now, Linux only
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * mmap.PAGESIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class StageRecord:
+    def __init__(self, stage: str, rows_in: int = 0):
+        self.stage = stage
+        self.rows_in = rows_in
+        self.rows_out = 0
+        self.bytes = 0
+        self.duration = 0.0
+        self.rss_growth = 0
+
+
+class _StageMetrics:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.rows_in = 0
+        self.rows_out = 0
+        self.bytes = 0
+        self.rss_growth = 0
+
+
+class Metrics:
+    """Per-stage totals of the processing pipeline, rendered for Prometheus"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, _StageMetrics] = {}
+        self._startup: Dict[str, float] = {}
+
+    def observe(self, record: StageRecord) -> None:
+        with self._lock:
+            stage = self._stages.setdefault(record.stage, _StageMetrics())
+            stage.count += 1
+            stage.duration += record.duration
+            bucket = bisect_left(DURATION_BUCKETS, record.duration)
+            for i in range(bucket, len(DURATION_BUCKETS)):
+                stage.buckets[i] += 1
+            stage.rows_in += record.rows_in
+            stage.rows_out += record.rows_out
+            stage.bytes += record.bytes
+            stage.rss_growth = max(stage.rss_growth, record.rss_growth)
+
+    def observe_startup(self, phase: str, duration: float) -> None:
+        with self._lock:
+            self._startup[phase] = duration
+
+    def render(self) -> str:
+        lines = []
+
+        def metric(name: str, kind: str, description: str, samples) -> None:
+            lines.append(f"# HELP astroapi_{name} {description}")
+            lines.append(f"# TYPE astroapi_{name} {kind}")
+            for suffix, labels, value in samples:
+                labels = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"astroapi_{name}{suffix}{{{labels}}} {value}")
+
+        with self._lock:
+            stages = sorted(self._stages.items())
+            metric(
+                "stage_duration_seconds",
+                "histogram",
+                "Time spent in each processing stage",
+                [
+                    ("_bucket", {"stage": name, "le": le}, count)
+                    for name, stage in stages
+                    for le, count in zip(
+                        [*DURATION_BUCKETS, "+Inf"], [*stage.buckets, stage.count]
+                    )
+                ]
+                + [("_sum", {"stage": name}, s.duration) for name, s in stages]
+                + [("_count", {"stage": name}, s.count) for name, s in stages],
+            )
+            for name, attribute, description in [
+                ("stage_rows_in_total", "rows_in", "Rows entering each stage"),
+                ("stage_rows_out_total", "rows_out", "Rows produced by each stage"),
+                ("stage_bytes_total", "bytes", "Bytes produced by each stage"),
+            ]:
+                metric(
+                    name,
+                    "counter",
+                    description,
+                    [("", {"stage": s}, getattr(m, attribute)) for s, m in stages],
+                )
+            metric(
+                "stage_rss_growth_bytes",
+                "gauge",
+                "Largest growth of the process resident memory over one run of "
+                "each stage, stages running at the same time included",
+                [("", {"stage": s}, m.rss_growth) for s, m in stages],
+            )
+            metric(
+                "process_peak_rss_bytes",
+                "gauge",
+                "Peak resident memory of the process since it started",
+                [("", {}, peak_rss())],
+            )
+            metric(
+                "startup_seconds",
+                "gauge",
+                "Time spent in each phase of the server startup",
+                [("", {"phase": p}, d) for p, d in self._startup.items()],
+            )
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def measure(stage: str, rows_in: int = 0) -> Iterator[StageRecord]:
+    # The caller fills rows_out and bytes on the yielded record
+    record = StageRecord(stage, rows_in)
+    rss = current_rss()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record.duration = time.perf_counter() - start
+        record.rss_growth = max(current_rss() - rss, 0)
+        metrics.observe(record)
+        timings = request_timings.get()
+        if timings is not None:
+            timings.append((stage, record.duration))
+
+
+def frame_bytes(df) -> int:
+    return int(df.memory_usage(index=False).sum())
+
+
+def server_timing(timings: List[Tuple[str, float]]) -> str:
+    # Stages repeated for several files are added up, in order of first use
+    totals: Dict[str, float] = {}
+    for stage, duration in timings:
+        totals[stage] = totals.get(stage, 0.0) + duration
+    return ", ".join(
+        f"{stage};dur={duration * 1000:.1f}" for stage, duration in totals.items()
+    )
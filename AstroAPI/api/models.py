@@ -1,8 +1,8 @@
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Literal, Optional
 
-from pydantic import field_validator
+from pydantic import field_validator, model_validator
 from sqlmodel import Field, Relationship, SQLModel
 
 
@@ -52,6 +52,57 @@ class VariableConfigRead(VariableConfig):
 class ConfigProcessRead(SQLModel):
     downsampling: float
     variables: Dict[str, VariableConfigRead]
+    seed: Optional[int] = None
+    # Spatial decimation after sampling: one point per grid cell (voxel_grid) or at
+    # most decimation_cap points per cell (density_cap), on a decimation_cells^3
+    # grid; target_points bounds the total number of points
+    decimation: Literal["none", "voxel_grid", "density_cap"] = "none"
+    # cells^3 flat cell indexes must fit in an int64
+    decimation_cells: int = Field(default=64, ge=1, le=2**21 - 1)
+    decimation_cap: Optional[int] = Field(default=None, ge=1)
+    target_points: Optional[int] = Field(default=None, ge=1)
+    # Duplicates removed when merging files: none, identical rows, same particle
+    # id (iord) or files resolving to the same path
+    deduplicate: Literal["none", "rows", "iord", "file"] = "none"
+
+
+class Frustum(SQLModel):
+    # (a, b, c, d) per plane, normals pointing inside the frustum
+    planes: List[List[float]]
+
+
+class Region(SQLModel):
+    # Axis-aligned box (box_min, box_max) or sphere (center, radius), in the
+    # coordinates of the spatial axes
+    shape: Literal["box", "sphere"] = "box"
+    box_min: Optional[List[float]] = None
+    box_max: Optional[List[float]] = None
+    center: Optional[List[float]] = None
+    radius: Optional[float] = None
+
+    @model_validator(mode="after")
+    def check_shape(self):
+        if self.shape == "box":
+            if self.box_min is None or self.box_max is None:
+                raise ValueError("A box needs box_min and box_max")
+            if len(self.box_min) != len(self.box_max):
+                raise ValueError("box_min and box_max must have the same length")
+        else:
+            if self.center is None or self.radius is None:
+                raise ValueError("A sphere needs center and radius")
+            if self.radius < 0:
+                raise ValueError("radius must not be negative")
+        return self
+
+
+class JobRead(SQLModel):
+    id: str
+    project_id: int
+    status: Literal["queued", "running", "done", "failed", "cancelled"]
+    stage: Optional[str] = None
+    done: int = 0
+    total: int = 0
+    error: Optional[str] = None
 
 
 # ----------------------------
@@ -169,6 +220,46 @@ class ProjectUpdate(ProjectBase):
 # ----------------------------
 
 
+class VariableStatisticsBase(SQLModel):
+    var_name: str
+    thr_min: float
+    thr_max: float
+    unit: str
+    count: int
+    nan_count: int = 0
+
+
+class VariableStatistics(VariableStatisticsBase, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    path: str = Field(index=True)
+    size: int
+    mtime: int
+
+
+class VariableHistogram(SQLModel, table=True):
+    # Equal-width bins between bin_min and bin_max, counts are int64 bytes
+    id: Optional[int] = Field(default=None, primary_key=True)
+    path: str = Field(index=True)
+    size: int
+    mtime: int
+    var_name: str
+    bin_min: float
+    bin_max: float
+    counts: bytes
+
+
+class VariableHistogramRead(SQLModel):
+    unit: str
+    count: int
+    bin_edges: List[float]
+    counts: List[int]
+    percentiles: Dict[str, float]
+
+
+# ----------------------------
+# ----------------------------
+
+
 class ConfigRenderBase(SQLModel):
     project_id: int
     var_name: str
@@ -0,0 +1,77 @@
+import asyncio
+import json
+from typing import AsyncIterator, Literal
+
+from fastapi import APIRouter, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+
+from api.exceptions import JobNotFinishedError, JobNotFoundError, JobResultExpiredError
+from api.jobs import job_manager
+from api.models import JobRead
+from api.serializers import pack_columns, pack_rows
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+FINISHED = ("done", "failed", "cancelled")
+
+
+@router.get("/{job_id}", response_model=JobRead)
+def read_job(*, job_id: str):
+    job = job_manager.get(job_id)
+    if not job:
+        raise JobNotFoundError(job_id)
+    return job
+
+
+@router.get("/{job_id}/events")
+async def job_events(*, job_id: str):
+    if not await run_in_threadpool(job_manager.get, job_id):
+        raise JobNotFoundError(job_id)
+
+    async def events() -> AsyncIterator[str]:
+        # Server-sent events: one message per progress change, until the job ends
+        last = None
+        while True:
+            # Progress comes from the manager process, read off the event loop
+            job = await run_in_threadpool(job_manager.get, job_id)
+            if job is None:
+                return
+            if job != last:
+                yield f"data: {json.dumps(job.model_dump())}\n\n"
+                last = job.model_copy()
+            if job.status in FINISHED:
+                return
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@router.get("/{job_id}/result", response_class=Response)
+def read_job_result(*, job_id: str, layout: Literal["rows", "columns"] = "rows"):
+    job = job_manager.get(job_id)
+    if not job:
+        raise JobNotFoundError(job_id)
+    if job.status != "done":
+        raise JobNotFinishedError(job_id, job.status)
+
+    df = job_manager.result(job_id)
+    if df is None:
+        raise JobResultExpiredError(job_id)
+    pack = pack_columns if layout == "columns" else pack_rows
+    return Response(
+        content=pack(df),
+        media_type="application/octet-stream",
+    )
+
+
+@router.delete("/{job_id}", response_model=JobRead)
+def cancel_job(*, job_id: str):
+    # Cancels a job that is still queued or running, forgets a finished one
+    job = job_manager.get(job_id)
+    if not job:
+        raise JobNotFoundError(job_id)
+    if job.status in FINISHED:
+        job_manager.remove(job_id)
+        return job
+    return job_manager.cancel(job_id)
@@ -1,32 +1,53 @@
-from typing import List
+from typing import Annotated, Dict, Iterator, List, Literal, Optional
 
 import msgpack
-from fastapi import APIRouter, Response
+from fastapi import APIRouter, Query, Response
+from fastapi.responses import StreamingResponse
+from pydantic import Field
 
 from api.crud import crud_config_process, crud_project, update_project_config
-from api.db import SessionDep
-from api.exceptions import DataProcessingError, ProjectNotFoundError
-from api.models import ConfigProcessRead, ProjectCreate, ProjectRead, ProjectUpdate
+from api.db import AsyncSessionDep, SessionDep
+from api.exceptions import (
+    DataProcessingError,
+    LODNotFoundError,
+    ProjectNotFoundError,
+    VariableNotFoundError,
+)
+from api.jobs import job_manager
+from api.metrics import measure
+from api.models import (
+    ConfigProcessRead,
+    Frustum,
+    JobRead,
+    ProjectCreate,
+    ProjectRead,
+    ProjectUpdate,
+    Region,
+    VariableHistogramRead,
+)
+from api.serializers import END_OF_STREAM, pack_columns, pack_frame, pack_rows
+from api.stages import rerun_stage, stage_store
 from api.utils import data_processor
+from src.histograms import HISTOGRAM_BINS
 
 router = APIRouter(prefix="/projects", tags=["projects"])
 
 
 @router.get("/", response_model=List[ProjectRead])
-def read_projects(*, session: SessionDep):
-    return crud_project.get_projects(session)
+async def read_projects(
+    *,
+    session: AsyncSessionDep,
+    limit: Optional[int] = Query(None, ge=1),
+    offset: int = Query(0, ge=0),
+    summary: bool = False,
+):
+    # Read-only, served from the async engine without taking a worker thread
+    return await session.run_sync(crud_project.get_projects, limit, offset, summary)
 
 
 @router.post("/", response_model=ProjectRead)
 def create_new_project(*, session: SessionDep, project: ProjectCreate):
     project = crud_project.create_project(session, project)
-    confs = data_processor.read_data(project.files)
-    for file, vars in confs.items():
-        for var_name, conf in vars.items():
-            conf_db = crud_config_process.create_config_process(
-                session, conf, project.id
-            )
-            crud_config_process.associate_config_file(session, conf_db.id, file)
     conf_read = crud_config_process._build_config_process_read(session, project.id)
 
     project_read = ProjectRead.model_validate(project)
@@ -58,29 +79,185 @@ def update_project(*, session: SessionDep, project_id: int, project: ProjectUpda
 @router.delete("/{project_id}")
 def remove_project(*, session: SessionDep, project_id: int):
     crud_project.delete_project(session, project_id)
+    stage_store.clear(project_id)
     return {"message": "Project deleted successfully"}
 
 
 @router.post("/{project_id}/process", response_class=Response)
-def process(*, session: SessionDep, project_id: int, config: ConfigProcessRead):
+def process(
+    *,
+    session: SessionDep,
+    project_id: int,
+    config: ConfigProcessRead,
+    layout: Literal["rows", "columns"] = "rows",
+):
     project = crud_project.get_project(session, project_id)
     if not project:
         raise ProjectNotFoundError(project_id)
 
     try:
         paths = project.paths
+        # Only the stages affected by the changes since the last run are recomputed
+        stage = rerun_stage(project.config_process, config)
         update_project_config(session, project_id, config)
-        processed_data = data_processor.process_data(project_id, paths, config)
-        data_dict = {
-            "columns": processed_data.columns.tolist(),
-            "rows": processed_data.values.tolist(),
-        }
-        binary_data = msgpack.packb(data_dict, use_bin_type=True)
+        processed_data = data_processor.process_data(
+            project_id, paths, config, stage=stage
+        )
+        with measure("encode", rows_in=len(processed_data)) as record:
+            if layout == "columns":
+                binary_data = pack_columns(processed_data)
+            else:
+                binary_data = pack_rows(processed_data)
+            record.rows_out, record.bytes = len(processed_data), len(binary_data)
         return Response(content=binary_data, media_type="application/octet-stream")
     except Exception as e:
         raise DataProcessingError(str(e), {"project_id": project_id})
 
 
+@router.post("/{project_id}/process/stream", response_class=StreamingResponse)
+def process_stream(
+    *,
+    session: SessionDep,
+    project_id: int,
+    config: ConfigProcessRead,
+    layout: Literal["rows", "columns"] = "rows",
+):
+    project = crud_project.get_project(session, project_id)
+    if not project:
+        raise ProjectNotFoundError(project_id)
+
+    paths = project.paths
+    update_project_config(session, project_id, config)
+    pack = pack_columns if layout == "columns" else pack_rows
+
+    def frames() -> Iterator[bytes]:
+        # Every frame is a length-prefixed msgpack block, the stream ends with an
+        # empty frame. Errors can't change the status code anymore, so they are
+        # sent as a last frame instead.
+        try:
+            for df in data_processor.iter_process_data(project_id, paths, config):
+                yield pack_frame(pack(df))
+        except Exception as e:
+            error = DataProcessingError(str(e), {"project_id": project_id})
+            yield pack_frame(
+                msgpack.packb(
+                    {
+                        "error": {
+                            "code": error.error_code,
+                            "message": error.detail,
+                            "context": error.context,
+                        }
+                    },
+                    use_bin_type=True,
+                )
+            )
+        yield END_OF_STREAM
+
+    return StreamingResponse(frames(), media_type="application/octet-stream")
+
+
+@router.post("/{project_id}/jobs", response_model=JobRead)
+def submit_process_job(
+    *, session: SessionDep, project_id: int, config: ConfigProcessRead
+):
+    project = crud_project.get_project(session, project_id)
+    if not project:
+        raise ProjectNotFoundError(project_id)
+
+    stage = rerun_stage(project.config_process, config)
+    update_project_config(session, project_id, config)
+    return job_manager.submit(project_id, project.paths, config, stage)
+
+
+@router.post("/{project_id}/lod")
+def build_lod(*, session: SessionDep, project_id: int, config: ConfigProcessRead):
+    project = crud_project.get_project(session, project_id)
+    if not project:
+        raise ProjectNotFoundError(project_id)
+
+    try:
+        update_project_config(session, project_id, config)
+        return data_processor.build_lod(project_id, project.paths, config)
+    except Exception as e:
+        raise DataProcessingError(str(e), {"project_id": project_id})
+
+
+@router.post("/{project_id}/lod/{level}", response_class=Response)
+def read_lod(
+    *,
+    session: SessionDep,
+    project_id: int,
+    level: int,
+    config: ConfigProcessRead,
+    frustum: Optional[Frustum] = None,
+    layout: Literal["rows", "columns"] = "rows",
+):
+    project = crud_project.get_project(session, project_id)
+    if not project:
+        raise ProjectNotFoundError(project_id)
+
+    try:
+        planes = frustum.planes if frustum else None
+        lod_data = data_processor.read_lod(project.paths, config, level, planes)
+    except Exception as e:
+        raise DataProcessingError(str(e), {"project_id": project_id})
+    if lod_data is None:
+        raise LODNotFoundError(project_id)
+
+    pack = pack_columns if layout == "columns" else pack_rows
+    return Response(content=pack(lod_data), media_type="application/octet-stream")
+
+
+@router.post("/{project_id}/region", response_class=Response)
+def query_region(
+    *,
+    session: SessionDep,
+    project_id: int,
+    config: ConfigProcessRead,
+    region: Region,
+    layout: Literal["rows", "columns"] = "rows",
+):
+    project = crud_project.get_project(session, project_id)
+    if not project:
+        raise ProjectNotFoundError(project_id)
+
+    try:
+        region_data = data_processor.query_region(project.paths, config, region)
+        pack = pack_columns if layout == "columns" else pack_rows
+        return Response(
+            content=pack(region_data), media_type="application/octet-stream"
+        )
+    except Exception as e:
+        raise DataProcessingError(str(e), {"project_id": project_id})
+
+
+@router.get("/{project_id}/histograms", response_model=Dict[str, VariableHistogramRead])
+def read_histograms(
+    *,
+    session: SessionDep,
+    project_id: int,
+    bins: int = Query(64, ge=1, le=HISTOGRAM_BINS),
+    percentiles: List[Annotated[float, Field(ge=0, le=100)]] = Query(
+        [1, 5, 25, 50, 75, 95, 99]
+    ),
+    variables: Optional[List[str]] = Query(None),
+):
+    project = crud_project.get_project(session, project_id)
+    if not project:
+        raise ProjectNotFoundError(project_id)
+
+    try:
+        histograms = data_processor.histograms(
+            project.paths, bins, percentiles, variables
+        )
+    except Exception as e:
+        raise DataProcessingError(str(e), {"project_id": project_id})
+    missing = [name for name in variables or [] if name not in histograms]
+    if missing:
+        raise VariableNotFoundError(project_id, missing)
+    return histograms
+
+
 # @router.post("/{project_id}/render")
 # def create_render_config(*, session: SessionDep, project_id: int, config: ConfigRender):
 #     config.project_id = project_id
@@ -0,0 +1,53 @@
+import struct
+from typing import Any, Dict
+
+import msgpack
+import numpy as np
+import pandas as pd
+
+# Columnar payloads carry raw little-endian buffers: float columns are narrowed
+# to float32, integer columns (particle ids...) keep 64 bits to stay exact
+COLUMN_DTYPE = np.dtype("<f4")
+INTEGER_DTYPES = {"i": np.dtype("<i8"), "u": np.dtype("<u8")}
+
+# Streamed frames are prefixed with their length as a little-endian uint32
+FRAME_HEADER = struct.Struct("<I")
+
+
+def pack_rows(df: pd.DataFrame) -> bytes:
+    data_dict = {
+        "columns": df.columns.tolist(),
+        "rows": df.values.tolist(),
+    }
+    return msgpack.packb(data_dict, use_bin_type=True)
+
+
+def column_dtype(values: np.ndarray) -> np.dtype:
+    return INTEGER_DTYPES.get(values.dtype.kind, COLUMN_DTYPE)
+
+
+def columnar_payload(df: pd.DataFrame) -> Dict[str, Any]:
+    # One contiguous buffer per column, the client can reinterpret it in place
+    arrays = [df[column].to_numpy() for column in df.columns]
+    dtypes = [column_dtype(values) for values in arrays]
+    return {
+        "columns": df.columns.tolist(),
+        "dtypes": [dtype.str for dtype in dtypes],
+        "shape": [len(df)],
+        "data": [
+            memoryview(np.ascontiguousarray(values, dtype))
+            for values, dtype in zip(arrays, dtypes)
+        ],
+    }
+
+
+def pack_columns(df: pd.DataFrame) -> bytes:
+    return msgpack.packb(columnar_payload(df), use_bin_type=True)
+
+
+def pack_frame(payload: bytes) -> bytes:
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+# A zero-length frame tells the client that the stream is complete
+END_OF_STREAM = pack_frame(b"")
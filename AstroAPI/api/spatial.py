@@ -0,0 +1,304 @@
+import hashlib
+import itertools
+import json
+import math
+import os
+import shutil
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from api.cache import file_signature
+from api.storage import (
+    ColumnWriter,
+    directory_size,
+    read_columns,
+    replace_directory,
+    temp_directory,
+)
+
+SPATIAL_DIR = "./data/spatial"
+# Grid resolution is picked so that cells hold about this many points
+POINTS_PER_CELL = 32
+MAX_BITS = 10
+# Rows handled at once while sorting a table into cell order
+BLOCK_ROWS = 1_000_000
+# Boxes are split in at most about this many Morton code ranges, cells on the
+# border of coarser ranges are then tested exactly like the others
+MAX_QUERY_RANGES = 4096
+# Indexes on disk beyond this are removed, least recently queried first
+SPATIAL_CACHE_BYTES = int(os.getenv("SPATIAL_CACHE_BYTES", 2 * 1024**3))
+
+META_FILE = "meta.json"
+CELLS_FILE = "cells.npy"
+
+
+def morton_codes(coords: np.ndarray, bits: int) -> np.ndarray:
+    # Interleave the bits of the cell coordinates so that nearby cells are stored
+    # next to each other
+    codes = np.zeros(len(coords), dtype=np.int64)
+    dims = coords.shape[1]
+    for bit in range(bits):
+        for axis in range(dims):
+            codes |= ((coords[:, axis] >> bit) & 1) << (bit * dims + axis)
+    return codes
+
+
+def morton_ranges(first: np.ndarray, last: np.ndarray, bits: int) -> np.ndarray:
+    # Sorted, disjoint [start, stop) ranges of Morton codes covering the cells
+    # from first to last (inclusive). The grid is split like an octree, nodes
+    # inside the box are a single range and nodes on its border are split
+    # further, until the cell level or MAX_QUERY_RANGES nodes.
+    dims = len(first)
+    children = np.array(list(itertools.product([0, 1], repeat=dims)))
+    nodes = np.zeros((1, dims), dtype=np.int64)
+    ranges = []
+    for level in range(bits + 1):
+        size = 2 ** (bits - level)
+        node_min = nodes * size
+        node_max = node_min + size - 1
+        overlap = ((node_max >= first) & (node_min <= last)).all(axis=1)
+        inside = ((node_min >= first) & (node_max <= last)).all(axis=1)
+        border = overlap & ~inside
+        last_level = level == bits or border.sum() * len(children) > MAX_QUERY_RANGES
+        covered = overlap if last_level else inside
+        codes = morton_codes(nodes[covered], level) << (dims * (bits - level))
+        ranges.append(np.stack([codes, codes + size**dims], axis=1))
+        if last_level:
+            break
+        nodes = (nodes[border][:, None] * 2 + children[None]).reshape(-1, dims)
+
+    ranges = np.concatenate(ranges)
+    ranges = ranges[np.argsort(ranges[:, 0])]
+    # Ranges that touch are merged
+    breaks = np.flatnonzero(ranges[1:, 0] != ranges[:-1, 1]) + 1
+    return np.stack(
+        [ranges[np.r_[0, breaks], 0], ranges[np.r_[breaks, len(ranges)] - 1, 1]],
+        axis=1,
+    )
+
+
+class SpatialIndex:
+    """Per-file tables sorted by Morton cell, for box and sphere queries
+
+    Each index stores the file's columns in cell order together with the sorted
+    codes of the occupied cells and their row offsets, so a query only touches
+    the cells overlapping the region. There is one index per version of a file
+    and position columns, it holds the columns of every selection queried so far.
+    """
+
+    def __init__(
+        self, directory: str = SPATIAL_DIR, max_bytes: int = SPATIAL_CACHE_BYTES
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def key(self, path: str, position_columns: List[str]) -> str:
+        payload = {"file": file_signature(path), "positions": position_columns}
+        return hashlib.sha256(json.dumps(payload).encode()).hexdigest()
+
+    def columns(self, key: str) -> Optional[List[str]]:
+        # Columns stored in the index, None when it is not built
+        try:
+            return self._meta(key)["columns"]
+        except FileNotFoundError:
+            return None
+
+    def build(
+        self,
+        key: str,
+        source: str,
+        chunks: Iterable[pd.DataFrame],
+        position_columns: List[str],
+    ) -> None:
+        # Chunks are written unsorted first and sorted block by block from the
+        # memory-mapped copy, only the cell codes and the order are in memory
+        path = self._path(key)
+        sorted_path = temp_directory(path)
+        unsorted_path = temp_directory(path)
+        try:
+            writer = ColumnWriter(unsorted_path)
+            dims = len(position_columns)
+            low, high = np.full(dims, np.inf), np.full(dims, -np.inf)
+            try:
+                for chunk in chunks:
+                    if len(chunk):
+                        positions = chunk[position_columns].to_numpy(dtype=float)
+                        low = np.minimum(low, positions.min(axis=0))
+                        high = np.maximum(high, positions.max(axis=0))
+                    writer.write(chunk)
+            except BaseException:
+                writer.discard()
+                raise
+            writer.close()
+
+            df = read_columns(unsorted_path)
+            rows = len(df)
+            if rows == 0:
+                low, high = np.zeros(dims), np.zeros(dims)
+            bits = math.ceil(math.log2(max(rows / POINTS_PER_CELL, 1)) / dims)
+            bits = min(max(bits, 1), MAX_BITS)
+
+            codes = np.concatenate(
+                [np.empty(0, dtype=np.int64)]
+                + [
+                    morton_codes(
+                        self._cell_coords(
+                            df[position_columns].iloc[start : start + BLOCK_ROWS],
+                            low,
+                            high,
+                            bits,
+                        ),
+                        bits,
+                    )
+                    for start in range(0, rows, BLOCK_ROWS)
+                ]
+            )
+            order = np.argsort(codes, kind="stable")
+            sorted_codes = codes[order]
+            del codes
+            starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+            starts = starts[starts < rows]
+
+            writer = ColumnWriter(sorted_path)
+            for start in range(0, max(rows, 1), BLOCK_ROWS):
+                writer.write(df.iloc[order[start : start + BLOCK_ROWS]])
+            writer.close()
+            columns = df.columns.tolist()
+            del df
+
+            np.save(
+                os.path.join(sorted_path, CELLS_FILE),
+                np.stack([sorted_codes[starts], starts], axis=1),
+            )
+            meta = {
+                "file": file_signature(source),
+                "columns": columns,
+                "positions": position_columns,
+                "low": low.tolist(),
+                "high": high.tolist(),
+                "bits": bits,
+                "rows": rows,
+                "bytes": directory_size(sorted_path),
+            }
+            with open(os.path.join(sorted_path, META_FILE), "w") as f:
+                json.dump(meta, f)
+        except BaseException:
+            shutil.rmtree(sorted_path, ignore_errors=True)
+            raise
+        finally:
+            shutil.rmtree(unsorted_path, ignore_errors=True)
+
+        # Queries never see a half written index
+        replace_directory(sorted_path, path)
+        self.evict(key)
+
+    def query_box(
+        self, key: str, box_min: List[float], box_max: List[float]
+    ) -> pd.DataFrame:
+        df, positions = self._candidates(key, box_min, box_max)
+        inside = ((positions >= box_min) & (positions <= box_max)).all(axis=1)
+        return df[inside]
+
+    def query_sphere(
+        self, key: str, center: List[float], radius: float
+    ) -> pd.DataFrame:
+        center = np.asarray(center, dtype=float)
+        df, positions = self._candidates(key, center - radius, center + radius)
+        inside = ((positions - center) ** 2).sum(axis=1) <= radius**2
+        return df[inside]
+
+    def _candidates(self, key: str, box_min, box_max):
+        # Rows of every occupied cell overlapping the box, to be tested exactly
+        meta = self._meta(key)
+        path = self._path(key)
+        # Keep the LRU order across processes and restarts
+        os.utime(os.path.join(path, META_FILE))
+        low, high = np.array(meta["low"]), np.array(meta["high"])
+        bits, dims = meta["bits"], len(meta["positions"])
+        box_min = np.asarray(box_min, dtype=float)
+        box_max = np.asarray(box_max, dtype=float)
+        if len(box_min) != dims or len(box_max) != dims:
+            raise ValueError(f"Regions must have {dims} coordinates")
+
+        df = read_columns(path)
+        if (box_max < low).any() or (box_min > high).any():
+            return df.iloc[:0], np.empty((0, dims))
+
+        # The cells of a Morton code range are contiguous in the table: each
+        # range is one row range, found by binary search in the occupied cells
+        first = self._cell_coords(box_min[None], low, high, bits)[0]
+        last = self._cell_coords(box_max[None], low, high, bits)[0]
+        ranges = morton_ranges(first, last, bits)
+        table = np.load(os.path.join(path, CELLS_FILE), mmap_mode="r")
+        occupied = table[:, 0]
+        found = np.searchsorted(occupied, ranges.ravel()).reshape(-1, 2)
+        found = found[found[:, 0] < found[:, 1]]
+        starts = np.where(
+            found < len(occupied),
+            table[np.minimum(found, len(occupied) - 1), 1],
+            meta["rows"],
+        )
+
+        counts = starts[:, 1] - starts[:, 0]
+        rows = np.arange(counts.sum()) + np.repeat(
+            starts[:, 0] - np.r_[0, np.cumsum(counts)[:-1]], counts
+        )
+        candidates = df.iloc[rows]
+        return candidates, candidates[meta["positions"]].to_numpy(dtype=float)
+
+    def evict(self, keep: str) -> None:
+        # Indexes of every process, scanned from disk. Older versions of the
+        # file just indexed are removed, then the least recently queried ones
+        # beyond the budget; the index just built is always kept.
+        indexes = []
+        if os.path.isdir(self.directory):
+            for key in os.listdir(self.directory):
+                # Indexes being built live in "<key>.<suffix>" directories
+                if "." in key:
+                    continue
+                meta_path = os.path.join(self._path(key), META_FILE)
+                try:
+                    with open(meta_path) as f:
+                        meta = json.load(f)
+                    mtime = os.path.getmtime(meta_path)
+                except (OSError, ValueError):
+                    continue
+                indexes.append((mtime, key, meta))
+        kept = next((meta for _, key, meta in indexes if key == keep), None)
+
+        with self._lock:
+            total = sum(meta.get("bytes", 0) for _, _, meta in indexes)
+            for _, key, meta in sorted(indexes, key=lambda index: index[:2]):
+                if key == keep:
+                    continue
+                file = meta.get("file")
+                stale = (
+                    kept is not None
+                    and file is not None
+                    and file[0] == kept["file"][0]
+                    and file != kept["file"]
+                )
+                if stale or total > self.max_bytes:
+                    shutil.rmtree(self._path(key), ignore_errors=True)
+                    total -= meta.get("bytes", 0)
+
+    def _cell_coords(self, positions, low, high, bits) -> np.ndarray:
+        positions = np.asarray(positions, dtype=float)
+        cells = 2**bits
+        extent = np.where(high > low, high - low, 1.0)
+        coords = np.floor((positions - low) / extent * cells).astype(np.int64)
+        return np.clip(coords, 0, cells - 1)
+
+    def _meta(self, key: str) -> Dict[str, Any]:
+        with open(os.path.join(self._path(key), META_FILE)) as f:
+            return json.load(f)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+
+spatial_index = SpatialIndex()
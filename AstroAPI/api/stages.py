@@ -0,0 +1,191 @@
+import json
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from api.models import ConfigProcessRead
+from api.storage import ColumnWriter, directory_size, read_columns, write_columns
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+STAGES_DIR = "./data/stages"
+STAGE_CACHE_BYTES = int(os.getenv("STAGE_CACHE_BYTES", 2 * 1024**3))
+
+# Pipeline stages in order, each one only depends on the output of the previous one
+STAGES = ["load", "sample", "filter"]
+
+META_FILE = "meta.json"
+
+
+def rerun_stage(
+    previous: Optional[ConfigProcessRead], config: ConfigProcessRead
+) -> str:
+    # Earliest stage invalidated by the changes from the stored config: other
+    # columns have to be loaded, another downsampling has to be sampled again,
+    # anything else (thresholds) only has to be filtered again
+    def selected(c: ConfigProcessRead) -> List[str]:
+        return sorted(k for k, v in c.variables.items() if v.selected)
+
+    if previous is None or selected(previous) != selected(config):
+        return "load"
+    if previous.downsampling != config.downsampling:
+        return "sample"
+    return "filter"
+
+
+class StageStore:
+    """Intermediate results of each project's last processing, one directory per stage
+
+    Every stage directory holds its columns and the metadata it was computed from,
+    a stage is only reused while that metadata matches. Stages of a project are
+    read and written under its lock, shared with the job worker processes.
+    Stages of all projects share a byte budget, least recently used ones go
+    first; the sizes are read back from disk so every process sees them all.
+    """
+
+    def __init__(self, directory: str = STAGES_DIR, max_bytes: int = STAGE_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._project_locks: Dict[int, threading.Lock] = {}
+
+    @contextmanager
+    def lock(self, pid: int, blocking: bool = True) -> Iterator[bool]:
+        # A thread lock within the process, a file lock across processes; yields
+        # whether it was acquired, always when blocking
+        with self._lock:
+            project_lock = self._project_locks.setdefault(pid, threading.Lock())
+        if not project_lock.acquire(blocking):
+            yield False
+            return
+        try:
+            if fcntl is None:
+                yield True
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._lock_path(pid), "a") as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+                except BlockingIOError:
+                    yield False
+                    return
+                try:
+                    yield True
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+        finally:
+            project_lock.release()
+
+    def fits(self, nbytes: int) -> bool:
+        return nbytes <= self.max_bytes
+
+    def loaded(
+        self, pid: int, index: int, meta: Dict[str, Any]
+    ) -> Optional[Tuple[pd.DataFrame, Dict[str, Any]]]:
+        return self._read(self._path(pid, f"load_{index}"), meta)
+
+    def save_loaded(
+        self, pid: int, index: int, meta: Dict[str, Any], chunks: Iterable[pd.DataFrame]
+    ) -> Dict[str, Any]:
+        # Chunks are written as they come, their sizes are kept with the metadata
+        path = self._path(pid, f"load_{index}")
+        writer = ColumnWriter(path)
+        rows = []
+        try:
+            for chunk in chunks:
+                writer.write(chunk)
+                rows.append(len(chunk))
+        except BaseException:
+            writer.discard()
+            raise
+        writer.close()
+        meta = {**meta, "chunks": rows, "bytes": directory_size(path)}
+        self._write_meta(path, meta)
+        self.evict(pid)
+        return meta
+
+    def sampled(self, pid: int, meta: Dict[str, Any]) -> Optional[pd.DataFrame]:
+        stage = self._read(self._path(pid, "sample"), meta)
+        return stage[0] if stage else None
+
+    def save_sampled(self, pid: int, meta: Dict[str, Any], df: pd.DataFrame) -> None:
+        path = self._path(pid, "sample")
+        write_columns(df, path)
+        self._write_meta(path, {**meta, "bytes": directory_size(path)})
+        self.evict(pid)
+
+    def discard_sampled(self, pid: int) -> None:
+        shutil.rmtree(self._path(pid, "sample"), ignore_errors=True)
+
+    def evict(self, pid: int) -> None:
+        # Called under the lock of project pid, whose stages are kept; stages of
+        # projects in use elsewhere are skipped
+        stages = []
+        if os.path.isdir(self.directory):
+            for project in os.listdir(self.directory):
+                project_path = os.path.join(self.directory, project)
+                if not project.startswith("project_") or not os.path.isdir(
+                    project_path
+                ):
+                    continue
+                for stage in os.listdir(project_path):
+                    meta_path = os.path.join(project_path, stage, META_FILE)
+                    try:
+                        with open(meta_path) as f:
+                            nbytes = json.load(f).get("bytes", 0)
+                        mtime = os.path.getmtime(meta_path)
+                    except (OSError, ValueError):
+                        continue
+                    owner = int(project[len("project_") :])
+                    stages.append((mtime, owner, stage, nbytes))
+
+        total = sum(nbytes for _, _, _, nbytes in stages)
+        for _, owner, stage, nbytes in sorted(stages):
+            if total <= self.max_bytes:
+                break
+            if owner == pid:
+                continue
+            with self.lock(owner, blocking=False) as acquired:
+                if acquired:
+                    shutil.rmtree(self._path(owner, stage), ignore_errors=True)
+                    total -= nbytes
+
+    def clear(self, pid: int) -> None:
+        with self.lock(pid):
+            shutil.rmtree(
+                os.path.join(self.directory, f"project_{pid}"), ignore_errors=True
+            )
+
+    def _read(
+        self, path: str, meta: Dict[str, Any]
+    ) -> Optional[Tuple[pd.DataFrame, Dict[str, Any]]]:
+        meta_path = os.path.join(path, META_FILE)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            stored = json.load(f)
+        if any(stored.get(k) != v for k, v in meta.items()):
+            return None
+        # Keep the LRU order
+        os.utime(meta_path)
+        return read_columns(path), stored
+
+    def _write_meta(self, path: str, meta: Dict[str, Any]) -> None:
+        with open(os.path.join(path, META_FILE), "w") as f:
+            json.dump(meta, f)
+
+    def _lock_path(self, pid: int) -> str:
+        return os.path.join(self.directory, f"project_{pid}.lock")
+
+    def _path(self, pid: int, stage: str) -> str:
+        return os.path.join(self.directory, f"project_{pid}", stage)
+
+
+stage_store = StageStore()
@@ -0,0 +1,110 @@
+import importlib
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from api.metrics import metrics
+from src.loaders import SCIENCE_MODULES
+
+# Import the science stack in a background thread once the server is up, so the
+# first request that opens a file does not pay for it
+WARM_UP = int(os.getenv("WARM_UP", 1))
+
+logger = logging.getLogger(__name__)
+
+
+def process_uptime() -> Optional[float]:
+    # Seconds since the process started (interpreter and imports), Linux only
+    try:
+        with open("/proc/self/stat") as f:
+            # Fields after the command name, which may contain spaces
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        started = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(uptime - started, 2)
+
+
+class StartupReport:
+    """Time spent in each phase of the server startup
+
+    "boot" runs from the process start to the application startup, it is where
+    import costs show up; warm-up phases are recorded when their import ends.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.phases: Dict[str, float] = {}
+        self.eager_modules: List[str] = []
+        self.warm_up = "disabled"
+
+    def record(self, phase: str, duration: float) -> None:
+        with self._lock:
+            self.phases[phase] = duration
+        metrics.observe_startup(phase, duration)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def begin(self) -> None:
+        uptime = process_uptime()
+        if uptime is not None:
+            self.record("boot", uptime)
+        # Science modules are expected to be imported lazily, not at startup
+        self.eager_modules = [m for m in SCIENCE_MODULES if m in sys.modules]
+        if self.eager_modules:
+            logger.warning(f"Imported at startup: {', '.join(self.eager_modules)}")
+
+    def ready(self) -> None:
+        uptime = process_uptime()
+        if uptime is not None:
+            self.record("ready", uptime)
+        logger.info(f"Startup: {self.summary()}")
+
+    def start_warm_up(self) -> Optional[threading.Thread]:
+        if not WARM_UP:
+            return None
+        self.warm_up = "running"
+        thread = threading.Thread(target=self._warm_up, name="warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def _warm_up(self) -> None:
+        try:
+            for module in SCIENCE_MODULES:
+                with self.phase(f"warm_up/{module}"):
+                    importlib.import_module(module)
+        except Exception as e:
+            # The module is imported again, and fails loudly, on first use
+            self.warm_up = "failed"
+            logger.warning(f"Warm-up failed: {e}")
+            return
+        self.warm_up = "done"
+        logger.info(f"Warm-up: {self.summary()}")
+
+    def summary(self) -> str:
+        with self._lock:
+            phases = list(self.phases.items())
+        return ", ".join(f"{phase} {duration:.3f}s" for phase, duration in phases)
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "phases": dict(self.phases),
+                "eager_modules": self.eager_modules,
+                "warm_up": self.warm_up,
+            }
+
+
+startup_report = StartupReport()
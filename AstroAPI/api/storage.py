@@ -0,0 +1,140 @@
+import errno
+import json
+import os
+import shutil
+import struct
+import tempfile
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+COLUMNS_FILE = "columns.json"
+
+# Space reserved for the .npy header of every column, rewritten on close once
+# the final number of rows is known
+HEADER_BYTES = 128
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+
+
+def _npy_header(dtype: np.dtype, rows: int) -> bytes:
+    header = repr(
+        {
+            "descr": np.lib.format.dtype_to_descr(dtype),
+            "fortran_order": False,
+            "shape": (rows,),
+        }
+    )
+    length = HEADER_BYTES - len(NPY_MAGIC) - 2
+    return (
+        NPY_MAGIC
+        + struct.pack("<H", length)
+        + (header.ljust(length - 1) + "\n").encode("latin1")
+    )
+
+
+def _column_path(directory: str, column: str) -> str:
+    return os.path.join(directory, f"{column}.npy")
+
+
+def temp_directory(directory: str) -> str:
+    # Unique per writer, next to its destination so it can be renamed in place
+    parent = os.path.dirname(directory) or "."
+    os.makedirs(parent, exist_ok=True)
+    return tempfile.mkdtemp(prefix=f"{os.path.basename(directory)}.", dir=parent)
+
+
+def replace_directory(src: str, dst: str) -> None:
+    # Moves src to dst, the last writer to finish wins. A directory can't be
+    # renamed over a non-empty one, the current dst is moved aside first
+    while True:
+        try:
+            os.rename(src, dst)
+            return
+        except OSError as e:
+            if e.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                raise
+        old = f"{src}.old"
+        try:
+            os.rename(dst, old)
+        except FileNotFoundError:
+            # Moved aside by another writer in the meantime
+            continue
+        shutil.rmtree(old, ignore_errors=True)
+
+
+class ColumnWriter:
+    """Appends DataFrame chunks to a directory with one .npy file per column"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.columns: Optional[List[str]] = None
+        self.rows = 0
+        self._tmp_directory = temp_directory(directory)
+        self._files = {}
+        self._dtypes = {}
+
+    def write(self, df: pd.DataFrame) -> None:
+        if self.columns is None:
+            self.columns = df.columns.tolist()
+            for column in self.columns:
+                self._dtypes[column] = df[column].to_numpy().dtype
+                self._files[column] = open(
+                    _column_path(self._tmp_directory, column), "wb"
+                )
+                self._files[column].write(b"\0" * HEADER_BYTES)
+
+        for column in self.columns:
+            values = np.ascontiguousarray(df[column].to_numpy(), self._dtypes[column])
+            values.tofile(self._files[column])
+        self.rows += len(df)
+
+    def close(self) -> None:
+        for column, f in self._files.items():
+            f.seek(0)
+            f.write(_npy_header(self._dtypes[column], self.rows))
+            f.close()
+        with open(os.path.join(self._tmp_directory, COLUMNS_FILE), "w") as f:
+            json.dump({"columns": self.columns or [], "rows": self.rows}, f)
+
+        # Readers never see a half written directory
+        replace_directory(self._tmp_directory, self.directory)
+
+    def discard(self) -> None:
+        for f in self._files.values():
+            f.close()
+        shutil.rmtree(self._tmp_directory, ignore_errors=True)
+
+
+def write_columns(df: pd.DataFrame, directory: str) -> None:
+    writer = ColumnWriter(directory)
+    writer.write(df)
+    writer.close()
+
+
+def read_columns(
+    directory: str, columns: Optional[List[str]] = None, mmap_mode: Optional[str] = "r"
+) -> pd.DataFrame:
+    """Load the selected columns (all by default), memory-mapped unless mmap_mode is None"""
+    with open(os.path.join(directory, COLUMNS_FILE)) as f:
+        stored_columns = json.load(f)["columns"]
+    if columns is None:
+        columns = stored_columns
+
+    missing = set(columns) - set(stored_columns)
+    if missing:
+        raise KeyError(f"Columns not found in {directory}: {sorted(missing)}")
+
+    return pd.DataFrame(
+        {
+            column: np.load(_column_path(directory, column), mmap_mode=mmap_mode)
+            for column in columns
+        },
+        copy=False,
+    )
+
+
+def directory_size(directory: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)
+    )
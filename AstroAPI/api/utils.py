@@ -1,12 +1,35 @@
+import contextvars
 import os
 import random
-from typing import Dict, List
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional
 
+import numpy as np
 import pandas as pd
 from sqlmodel import SQLModel
 
-from api.models import ConfigProcessCreate, ConfigProcessRead, File
+from api.cache import file_signature, result_cache
+from api.catalog import statistics_catalog
+from api.exceptions import FileScanError
+from api.lod import lod_store
+from api.metrics import frame_bytes, measure
+from api.models import (
+    ConfigProcessCreate,
+    ConfigProcessRead,
+    File,
+    Region,
+    VariableHistogramRead,
+)
+from api.spatial import spatial_index
+from api.stages import STAGES, stage_store
+from api.storage import ColumnWriter, write_columns
 from src import gets, processors
+from src.histograms import histogram_edges, histogram_percentiles, merge_histograms
+from src.utils import getFileType
+
+FILE_WORKERS = int(os.getenv("FILE_WORKERS", min(4, os.cpu_count() or 1)))
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", min(4, os.cpu_count() or 1)))
 
 
 class FileVariable(SQLModel):
@@ -38,17 +61,38 @@ class DataProcessor:
         if os.getenv("API_TEST"):
             return DataProcessor.read_data_test(files)
 
+        # Files are scanned concurrently, failures are collected per file
+        paths = [file.path for file in files]
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(SCAN_WORKERS, len(paths)))
+        ) as executor:
+            futures = {
+                path: executor.submit(
+                    contextvars.copy_context().run,
+                    statistics_catalog.get_thresholds,
+                    path,
+                )
+                for path in paths
+            }
+
         config_processes = {}
-        for file in files:
-            config_processes[file.path] = {}
-            variables = gets.getThresholds(file.path)
+        errors = {}
+        for path, future in futures.items():
+            try:
+                variables = future.result()
+            except Exception as e:
+                errors[path] = str(e)
+                continue
+            config_processes[path] = {}
             for key, value in variables.items():
                 value.thr_min_sel = value.thr_min
                 value.thr_max_sel = value.thr_max
                 config_process = ConfigProcessCreate(
                     downsampling=1, var_name=key, **value.model_dump()
                 )
-                config_processes[file.path][key] = config_process
+                config_processes[path][key] = config_process
+        if errors:
+            raise FileScanError(errors)
         return config_processes
 
     @staticmethod
@@ -63,17 +107,367 @@ class DataProcessor:
         return config_processes
 
     @staticmethod
-    def process_data(pid: int, paths: List[str], config: ConfigProcessRead) -> str:
-        combined_df = pd.DataFrame()
+    def file_rows(path: str) -> int:
+        # Row count of a file from the catalog, without loading it
+        return next(iter(statistics_catalog.get_statistics(path).values())).count
+
+    @staticmethod
+    def sampling_fractions(paths: List[str], config: ConfigProcessRead) -> List[float]:
+        # Split round(downsampling * total rows) across files proportionally to
+        # their size (largest remainder), using the row counts of the catalog
+        rows = [DataProcessor.file_rows(path) for path in paths]
+        quotas = [config.downsampling * n for n in rows]
+        counts = [int(quota) for quota in quotas]
+        remainder = round(sum(quotas)) - sum(counts)
+        by_remainder = sorted(
+            range(len(paths)), key=lambda i: quotas[i] - counts[i], reverse=True
+        )
+        for i in by_remainder[:remainder]:
+            counts[i] += 1
+        return [count / n if n else 0.0 for count, n in zip(counts, rows)]
+
+    @staticmethod
+    def file_rngs(
+        paths: List[str], config: ConfigProcessRead
+    ) -> List[np.random.Generator]:
+        # Independent streams per file, so results don't depend on the order in
+        # which concurrent files draw their samples
+        seeds = np.random.SeedSequence(config.seed).spawn(len(paths))
+        return [np.random.default_rng(seed) for seed in seeds]
+
+    @staticmethod
+    def unique_files(paths: List[str]) -> List[str]:
+        # Drops paths that resolve to a file already in the list
+        seen = set()
+        unique = []
         for path in paths:
-            df = processors.convertToDataframe(path, config)
-            combined_df = pd.concat(
-                [combined_df, df], ignore_index=True
-            ).drop_duplicates()
-        new_path = f"./data/project_{pid}_processed.csv"
-        combined_df.to_csv(new_path, index=False)
+            real_path = os.path.realpath(path)
+            if real_path not in seen:
+                seen.add(real_path)
+                unique.append(path)
+        return unique
+
+    @staticmethod
+    def load_columns(config: ConfigProcessRead) -> List[str]:
+        # Columns loaded from simulations, cubes always load the same ones
+        columns = [k for k, v in config.variables.items() if v.selected]
+        if config.deduplicate == "iord" and "iord" not in columns:
+            columns.append("iord")
+        return columns
+
+    @staticmethod
+    def sampled_data(
+        pid: int,
+        paths: List[str],
+        config: ConfigProcessRead,
+        progress: Callable[[str, int, int], None],
+        stage: str = "load",
+    ) -> pd.DataFrame:
+        # Concurrent processing of a project (requests, jobs) waits for its stages
+        with stage_store.lock(pid):
+            return DataProcessor._sampled_data(pid, paths, config, progress, stage)
+
+    @staticmethod
+    def _sampled_data(
+        pid: int,
+        paths: List[str],
+        config: ConfigProcessRead,
+        progress: Callable[[str, int, int], None],
+        stage: str,
+    ) -> pd.DataFrame:
+        # Load and sample stages, from the project's stored stages when the config
+        # and files they were computed from are unchanged
+        reuse = STAGES[: STAGES.index(stage)]
+        load_metas = [
+            {
+                "file": file_signature(path),
+                "columns": (
+                    None
+                    if getFileType(path) == "fits"
+                    else DataProcessor.load_columns(config)
+                ),
+            }
+            for path in paths
+        ]
+        fractions = DataProcessor.sampling_fractions(paths, config)
+        sample_meta = {
+            "files": load_metas,
+            "fractions": fractions,
+            "seed": config.seed,
+        }
+        if "sample" in reuse:
+            df = stage_store.sampled(pid, sample_meta)
+            if df is not None:
+                return df
+
+        rngs = DataProcessor.file_rngs(paths, config)
+        finished = []
+        lock = threading.Lock()
+
+        def reported(chunks: Iterator[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+            for chunk in chunks:
+                progress("load", len(finished), len(paths))
+                yield chunk
+
+        def load(i: int, frac: float) -> pd.DataFrame:
+            with measure("load") as record:
+                chunks = processors.iter_load_chunks(
+                    paths[i], config, frac=frac, rng=rngs[i]
+                )
+                df = pd.concat(list(reported(chunks)), ignore_index=True)
+                record.rows_out, record.bytes = len(df), frame_bytes(df)
+            return df
+
+        def load_bytes(i: int) -> int:
+            columns = load_metas[i]["columns"] or gets.getKeys(paths[i])
+            return DataProcessor.file_rows(paths[i]) * len(columns) * 8
+
+        # Unsampled files are kept as load stages when they all fit the budget
+        keep_loaded = stage_store.fits(
+            sum(load_bytes(i) for i in range(len(paths)) if fractions[i] >= 1)
+        )
+
+        def sample(i: int) -> pd.DataFrame:
+            loaded = stage_store.loaded(pid, i, load_metas[i]) if reuse else None
+            if loaded is None and (fractions[i] < 1 or not keep_loaded):
+                # Sampled while loading, the load stage is only kept unsampled
+                df = load(i, fractions[i])
+            else:
+                if loaded is None:
+                    with measure("load") as record:
+                        chunks = processors.iter_load_chunks(paths[i], config)
+                        meta = stage_store.save_loaded(
+                            pid, i, load_metas[i], reported(chunks)
+                        )
+                        record.rows_out = sum(meta["chunks"])
+                        record.bytes = os.path.getsize(paths[i])
+                    loaded = stage_store.loaded(pid, i, meta)
+                df, meta = loaded
+                if fractions[i] < 1:
+                    progress("sample", len(finished), len(paths))
+                    with measure("sample", rows_in=len(df)) as record:
+                        rows = processors.sample_rows(
+                            meta["chunks"], fractions[i], rngs[i]
+                        )
+                        df = df.iloc[rows]
+                        record.rows_out, record.bytes = len(df), frame_bytes(df)
+            with lock:
+                finished.append(i)
+            return df
+
+        # Files are loaded concurrently and merged once at the end, every task
+        # runs in a copy of the caller's context so its stages are timed with
+        # the request
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(FILE_WORKERS, len(paths)))
+        ) as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, sample, i)
+                for i in range(len(paths))
+            ]
+            frames = [future.result() for future in futures]
+        with measure("concat", rows_in=sum(len(f) for f in frames)) as record:
+            df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+            record.rows_out, record.bytes = len(df), frame_bytes(df)
+        del frames
+        # Without sampling the loaded stages are the sample already
+        if all(frac >= 1 for frac in fractions):
+            stage_store.discard_sampled(pid)
+        elif stage_store.fits(frame_bytes(df)):
+            stage_store.save_sampled(pid, sample_meta, df)
+        return df
+
+    # Cache key of the result last written as each project's artifact
+    artifact_keys: Dict[int, str] = {}
+
+    @staticmethod
+    def process_data(
+        pid: int,
+        paths: List[str],
+        config: ConfigProcessRead,
+        progress: Optional[Callable[[str, int, int], None]] = None,
+        stage: str = "load",
+    ) -> str:
+        # progress(stage, done, total) is called between chunks, it may raise to
+        # abort the processing. Stages before `stage` are reused when still valid.
+        progress = progress or (lambda stage, done, total: None)
+        new_path = f"./data/project_{pid}_processed"
+        key = result_cache.key(paths, config)
+        with measure("cache") as record:
+            combined_df = result_cache.get(key)
+            if combined_df is not None:
+                record.rows_out = len(combined_df)
+        if combined_df is not None:
+            if DataProcessor.artifact_keys.get(pid) != key or not os.path.exists(
+                new_path
+            ):
+                write_columns(combined_df, new_path)
+                DataProcessor.artifact_keys[pid] = key
+            return combined_df
+
+        if config.deduplicate == "file":
+            paths = DataProcessor.unique_files(paths)
+        combined_df = DataProcessor.sampled_data(pid, paths, config, progress, stage)
+        with measure("filter", rows_in=len(combined_df)) as record:
+            combined_df = processors.filter_dataframe(combined_df, config)
+            combined_df = combined_df.reset_index(drop=True)
+            record.rows_out = len(combined_df)
+        progress("deduplicate", len(paths), len(paths))
+        with measure("deduplicate", rows_in=len(combined_df)) as record:
+            combined_df = processors.deduplicate(combined_df, config)
+            record.rows_out = len(combined_df)
+        rng = np.random.default_rng(config.seed)
+        progress("decimate", len(paths), len(paths))
+        with measure("decimate", rows_in=len(combined_df)) as record:
+            combined_df = processors.decimate(combined_df, config, rng)
+            record.rows_out = len(combined_df)
+        with measure("write", rows_in=len(combined_df)) as record:
+            write_columns(combined_df, new_path)
+            DataProcessor.artifact_keys[pid] = key
+            result_cache.put(key, paths, combined_df)
+            record.rows_out, record.bytes = len(combined_df), frame_bytes(combined_df)
         return combined_df
         # return new_path
 
+    @staticmethod
+    def iter_process_data(
+        pid: int, paths: List[str], config: ConfigProcessRead
+    ) -> Iterator[pd.DataFrame]:
+        # Chunks are handed out as soon as they are ready, so unlike
+        # process_data deduplication and decimation are applied chunk by chunk
+        # (target_points bounds each chunk)
+        new_path = f"./data/project_{pid}_processed"
+        DataProcessor.artifact_keys.pop(pid, None)
+        if config.deduplicate == "file":
+            paths = DataProcessor.unique_files(paths)
+        rng = np.random.default_rng(config.seed)
+        fractions = DataProcessor.sampling_fractions(paths, config)
+        rngs = DataProcessor.file_rngs(paths, config)
+        writer = ColumnWriter(new_path)
+        try:
+            for path, frac, file_rng in zip(paths, fractions, rngs):
+                for df in processors.iter_dataframe_chunks(
+                    path, config, frac=frac, rng=file_rng
+                ):
+                    df = processors.deduplicate(df, config)
+                    df = processors.decimate(df, config, rng)
+                    writer.write(df)
+                    yield df
+        except BaseException:
+            # Failed or abandoned by the client: keep the previous artifact
+            writer.discard()
+            raise
+        writer.close()
+
+    @staticmethod
+    def build_lod(
+        pid: int, paths: List[str], config: ConfigProcessRead
+    ) -> Dict[str, Any]:
+        # Pyramids are built on the spatial axes, they are part of the key
+        key = result_cache.key(paths, config, axes=True)
+        try:
+            return lod_store.meta(key)
+        except FileNotFoundError:
+            pass
+        df = DataProcessor.process_data(pid, paths, config)
+        columns = processors.spatial_columns(df.columns, config)
+        if not columns:
+            raise ValueError("A level-of-detail pyramid needs spatial columns")
+        return lod_store.build(key, df, columns, np.random.default_rng(config.seed))
+
+    @staticmethod
+    def read_lod(
+        paths: List[str],
+        config: ConfigProcessRead,
+        level: int,
+        planes: Optional[List[List[float]]] = None,
+    ) -> Optional[pd.DataFrame]:
+        return lod_store.read_level(
+            result_cache.key(paths, config, axes=True), level, planes
+        )
+
+    @staticmethod
+    def query_region(
+        paths: List[str], config: ConfigProcessRead, region: Region
+    ) -> pd.DataFrame:
+        results = []
+        for path in paths:
+            if getFileType(path) == "fits":
+                columns = gets.getKeys(path)
+            else:
+                columns = [k for k, v in config.variables.items() if v.selected]
+            position_columns = processors.spatial_columns(columns, config)
+            if not position_columns:
+                raise ValueError("Region queries need spatial columns")
+
+            # Indexes are built on first use, for each version of a file and
+            # its positions. A selection with new columns rebuilds the index with
+            # those and the ones already stored.
+            key = spatial_index.key(path, position_columns)
+            stored = spatial_index.columns(key)
+            if stored is None or not set(columns) <= set(stored):
+                load_config = config.model_copy(deep=True)
+                for var_name in stored or []:
+                    if var_name in load_config.variables:
+                        load_config.variables[var_name].selected = True
+                chunks = processors.iter_load_chunks(path, load_config)
+                spatial_index.build(key, path, chunks, position_columns)
+
+            if region.shape == "sphere":
+                df = spatial_index.query_sphere(key, region.center, region.radius)
+            else:
+                df = spatial_index.query_box(key, region.box_min, region.box_max)
+            # Columns of other selections are dropped, in stored order
+            df = df[[column for column in df.columns if column in columns]]
+            results.append(processors.filter_dataframe(df, config))
+        return pd.concat(results, ignore_index=True)
+
+    @staticmethod
+    def histograms(
+        paths: List[str],
+        bins: int,
+        percentiles: List[float],
+        variables: Optional[List[str]] = None,
+    ) -> Dict[str, VariableHistogramRead]:
+        # Merged from the histograms stored in the catalog, files are only read
+        # when their entry is missing or stale
+        paths = DataProcessor.unique_files(paths)
+
+        def distributions(path: str):
+            statistics = statistics_catalog.get_statistics(path)
+            return statistics, statistics_catalog.get_histograms(path)
+
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(SCAN_WORKERS, len(paths)))
+        ) as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, distributions, path)
+                for path in paths
+            ]
+            per_file = [future.result() for future in futures]
+
+        if variables is None:
+            variables = list(dict.fromkeys(k for stats, _ in per_file for k in stats))
+        result = {}
+        for name in variables:
+            files = [
+                (stats[name], hists[name]) for stats, hists in per_file if name in hists
+            ]
+            if not files:
+                continue
+            # Percentiles come from the fine histogram, before rebinning
+            fine = merge_histograms(hist for _, hist in files)
+            coarse = merge_histograms([fine], bins)
+            count = int(fine[2].sum())
+            values = histogram_percentiles(fine, percentiles) if count else []
+            result[name] = VariableHistogramRead(
+                unit=files[0][0].unit,
+                count=count,
+                bin_edges=histogram_edges(coarse).tolist(),
+                counts=coarse[2].tolist(),
+                percentiles={f"{q:g}": v for q, v in zip(percentiles, values)},
+            )
+        return result
+
 
 data_processor = DataProcessor()
@@ -0,0 +1,252 @@
+"""Benchmarks of the processing pipeline on synthetic snapshots and cubes
+
+Run from AstroAPI/ with `python -m benchmarks.run`. Results are the median of
+--repeat runs; --save-baseline stores them, later runs fail (exit code 1) when a
+benchmark is slower than its baseline by more than --tolerance.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from typing import Callable, Dict, List, Optional
+
+from benchmarks.synthetic import ensure_cube, ensure_snapshot
+
+SIZES = {
+    "small": {"particles": 20_000, "cube": (32, 64, 64)},
+    "medium": {"particles": 200_000, "cube": (64, 128, 128)},
+    "large": {"particles": 2_000_000, "cube": (128, 256, 256)},
+}
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+# Differences below this are noise whatever the tolerance
+MIN_DELTA = 0.005
+
+
+def timed(
+    run: Callable[[], None], repeat: int, setup: Optional[Callable[[], None]] = None
+) -> float:
+    durations = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        run()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def full_config(path: str, seed: Optional[int] = None):
+    from api.models import ConfigProcessRead
+    from src import gets
+
+    variables = gets.getThresholds(path)
+    for variable in variables.values():
+        variable.selected = True
+        variable.thr_min_sel = variable.thr_min
+        variable.thr_max_sel = variable.thr_max
+    return ConfigProcessRead(downsampling=1.0, variables=variables, seed=seed)
+
+
+def narrow(config, fraction: float = 0.1):
+    # Thresholds of every variable moved inwards by fraction of their range
+    config = config.model_copy(deep=True)
+    for variable in config.variables.values():
+        margin = (variable.thr_max - variable.thr_min) * fraction
+        variable.thr_min_sel = variable.thr_min + margin
+        variable.thr_max_sel = variable.thr_max - margin
+    return config
+
+
+def bench_startup(repeat: int) -> Dict[str, float]:
+    # A fresh interpreter importing the application, as a server process does
+    env = {**os.environ, "PYTHONPATH": ROOT}
+    command = [sys.executable, "-c", "import api.main"]
+    return {
+        "startup/import_app": timed(
+            lambda: subprocess.run(command, env=env, check=True), repeat
+        )
+    }
+
+
+def bench_stages(size: str, snapshot: str, cube: str, repeat: int) -> Dict[str, float]:
+    from api.serializers import pack_columns, pack_rows
+    from src import gets, processors
+    from src.handles import handle_cache
+
+    results = {}
+    # Files are reopened for every run, as on a cold server
+    cold = handle_cache.clear
+
+    results["getThresholds/snapshot"] = timed(
+        lambda: gets.getThresholds(snapshot), repeat, cold
+    )
+    results["getThresholds/cube"] = timed(
+        lambda: gets.getThresholds(cube), repeat, cold
+    )
+
+    config = full_config(snapshot)
+    results["pynbody_to_dataframe"] = timed(
+        lambda: processors.pynbody_to_dataframe(snapshot, config), repeat, cold
+    )
+    results["fits_to_dataframe"] = timed(
+        lambda: processors.fits_to_dataframe(cube), repeat, cold
+    )
+
+    df = processors.pynbody_to_dataframe(snapshot, config)
+    filter_config = narrow(config)
+    results["filter_dataframe"] = timed(
+        lambda: processors.filter_dataframe(df, filter_config), repeat
+    )
+    results["pack_rows"] = timed(lambda: pack_rows(df), repeat)
+    results["pack_columns"] = timed(lambda: pack_columns(df), repeat)
+    return {f"{size}/{name}": value for name, value in results.items()}
+
+
+def bench_http(size: str, snapshot: str, repeat: int) -> Dict[str, float]:
+    from fastapi.testclient import TestClient
+
+    from api.main import app
+    from src.handles import handle_cache
+
+    results = {}
+    with TestClient(app) as client:
+
+        def create_project() -> dict:
+            response = client.post(
+                "/api/projects/", json={"name": size, "paths": [snapshot]}
+            )
+            response.raise_for_status()
+            return response.json()
+
+        def process(project: dict, config) -> None:
+            response = client.post(
+                f"/api/projects/{project['id']}/process",
+                content=config.model_dump_json(),
+                headers={"Content-Type": "application/json"},
+            )
+            response.raise_for_status()
+
+        config = full_config(snapshot)
+        seeds = iter(range(repeat))
+        projects = []
+
+        def new_project() -> None:
+            # A new project and seed: nothing is cached but the file statistics
+            handle_cache.clear()
+            projects.append((create_project(), next(seeds)))
+
+        results["http/process_cold"] = timed(
+            lambda: process(
+                projects[-1][0], config.model_copy(update={"seed": projects[-1][1]})
+            ),
+            repeat,
+            new_project,
+        )
+
+        project = create_project()
+        process(project, config)
+        fractions = iter([0.05 + 0.01 * i for i in range(repeat)])
+        results["http/process_refilter"] = timed(
+            lambda: process(project, narrow(config, next(fractions))), repeat
+        )
+        results["http/process_cached"] = timed(lambda: process(project, config), repeat)
+    return {f"{size}/{name}": value for name, value in results.items()}
+
+
+def compare(
+    results: Dict[str, float], baseline: Dict[str, float], tolerance: float
+) -> List[str]:
+    regressions = []
+    for name, value in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        if value > reference * (1 + tolerance) and value - reference > MIN_DELTA:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", nargs="+", choices=list(SIZES), default=["small", "medium"]
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--data-dir",
+        default=os.path.join(tempfile.gettempdir(), "astroapi-benchmarks"),
+        help="Where synthetic files are generated, they are reused across runs",
+    )
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.3)
+    parser.add_argument("--skip-http", action="store_true")
+    args = parser.parse_args(argv)
+
+    warnings.filterwarnings("ignore")
+    baseline_path = os.path.abspath(args.baseline)
+    data_dir = os.path.abspath(args.data_dir)
+    os.makedirs(data_dir, exist_ok=True)
+
+    # The API keeps its database and artifacts under ./data, use a scratch one
+    cwd = os.getcwd()
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="astroapi-bench-") as workdir:
+        os.makedirs(os.path.join(workdir, "data"))
+        os.chdir(workdir)
+        try:
+            results.update(bench_startup(args.repeat))
+            for size in args.sizes:
+                snapshot = ensure_snapshot(data_dir, SIZES[size]["particles"])
+                cube = ensure_cube(data_dir, SIZES[size]["cube"])
+                results.update(bench_stages(size, snapshot, cube, args.repeat))
+                if not args.skip_http:
+                    results.update(bench_http(size, snapshot, args.repeat))
+        finally:
+            os.chdir(cwd)
+
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)["results"]
+
+    width = max(len(name) for name in results)
+    for name, value in results.items():
+        reference = baseline.get(name)
+        change = f"{(value / reference - 1) * 100:+7.1f}%" if reference else ""
+        print(f"{name:<{width}}  {value * 1000:10.2f} ms  {change}")
+
+    if args.save_baseline:
+        with open(baseline_path, "w") as f:
+            json.dump(
+                {
+                    "machine": platform.platform(),
+                    "python": platform.python_version(),
+                    "repeat": args.repeat,
+                    "results": {**baseline, **results},
+                },
+                f,
+                indent=2,
+            )
+        print(f"Baseline saved to {baseline_path}")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for name in regressions:
+        print(
+            f"REGRESSION {name}: {results[name] * 1000:.2f} ms, "
+            f"baseline {baseline[name] * 1000:.2f} ms"
+        )
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+import os
+from typing import Tuple
+
+import h5py
+import numpy as np
+from astropy.io import fits
+from astropy.wcs import WCS
+
+
+def make_snapshot(path: str, n_particles: int, seed: int = 0) -> str:
+    # Single-file GadgetHDF snapshot of gas particles, readable by pynbody
+    rng = np.random.default_rng(seed)
+    with h5py.File(path, "w") as f:
+        header = f.create_group("Header")
+        header.attrs["NumPart_ThisFile"] = np.array(
+            [n_particles, 0, 0, 0, 0, 0], dtype=np.uint32
+        )
+        header.attrs["NumPart_Total"] = np.array(
+            [n_particles, 0, 0, 0, 0, 0], dtype=np.uint32
+        )
+        header.attrs["NumPart_Total_HighWord"] = np.zeros(6, dtype=np.uint32)
+        header.attrs["MassTable"] = np.zeros(6)
+        header.attrs["Time"] = 1.0
+        header.attrs["Redshift"] = 0.0
+        header.attrs["BoxSize"] = 100.0
+        header.attrs["NumFilesPerSnapshot"] = 1
+        header.attrs["Omega0"] = 0.3
+        header.attrs["OmegaLambda"] = 0.7
+        header.attrs["HubbleParam"] = 0.7
+        for flag in ["Sfr", "Cooling", "StellarAge", "Metals", "Feedback"]:
+            header.attrs[f"Flag_{flag}"] = 0
+
+        gas = f.create_group("PartType0")
+        gas["Coordinates"] = rng.normal(50, 10, size=(n_particles, 3))
+        gas["Velocities"] = rng.normal(0, 100, size=(n_particles, 3)).astype(np.float32)
+        gas["ParticleIDs"] = np.arange(n_particles, dtype=np.uint64)
+        gas["Masses"] = rng.uniform(1, 2, n_particles).astype(np.float32)
+        gas["Density"] = rng.lognormal(0, 1, n_particles).astype(np.float32)
+        gas["InternalEnergy"] = rng.lognormal(0, 1, n_particles).astype(np.float32)
+    return path
+
+
+def make_cube(path: str, shape: Tuple[int, int, int], seed: int = 0) -> str:
+    # Spectral cube (channel, dec, ra) with a celestial WCS, a radio velocity
+    # axis and a few blanked voxels
+    n_chan, n_y, n_x = shape
+    wcs = WCS(naxis=3)
+    wcs.wcs.ctype = ["RA---SIN", "DEC--SIN", "VRAD"]
+    wcs.wcs.crval = [180, 30, 1000]
+    wcs.wcs.cdelt = [-0.001, 0.001, 500]
+    wcs.wcs.crpix = [n_x / 2, n_y / 2, n_chan / 2]
+    wcs.wcs.cunit = ["deg", "deg", "m/s"]
+
+    rng = np.random.default_rng(seed)
+    data = rng.normal(size=shape).astype(np.float32)
+    data[0, 0, : min(5, n_x)] = np.nan
+    header = wcs.to_header()
+    header["BUNIT"] = "K"
+    fits.writeto(path, data, header, overwrite=True)
+    return path
+
+
+def ensure_snapshot(directory: str, n_particles: int) -> str:
+    # Generated once per size, the same seed always gives the same file
+    path = os.path.join(directory, f"snapshot_{n_particles}.hdf5")
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        make_snapshot(path, n_particles)
+    return path
+
+
+def ensure_cube(directory: str, shape: Tuple[int, int, int]) -> str:
+    path = os.path.join(directory, "cube_{}x{}x{}.fits".format(*shape))
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        make_cube(path, shape)
+    return path
@@ -1,17 +1,18 @@
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
 import numpy as np
 
-from api.models import VariableConfig, VariableConfigRead
-from src.loaders import loadObservation, loadSimulation
-from src.processors import fits_to_dataframe
+from api.models import VariableConfigRead, VariableStatisticsBase
+from src.handles import handle_cache
+from src.histograms import Histogram, histogram, merge_histograms
+from src.processors import fits_celestial_plane, iter_fits_slabs
 from src.utils import getFileType
 
 
 def getSimFamily(path: str) -> List[str]:
 
-    sim = loadSimulation(path)
-    families = [str(el) for el in sim.families()]
+    with handle_cache.simulation(path) as sim:
+        families = [str(el) for el in sim.families()]
 
     return families
 
@@ -22,66 +23,144 @@ def getKeys(path: str, family=None) -> list:
         return ["ra", "dec", "velocity", "intensity"]
 
     else:
-        sim = loadSimulation(path, family)
-        keys = sim.loadable_keys()
-        del sim
+        with handle_cache.simulation(path, family) as sim:
+            keys = sim.loadable_keys()
 
         return keys
 
 
-def getThresholds(path: str, family=None) -> Dict[str, VariableConfigRead]:
+def _getVariableStatistics(
+    var_name: str, values: np.ndarray, unit: str
+) -> VariableStatisticsBase:
+
+    return VariableStatisticsBase(
+        var_name=var_name,
+        thr_min=float(np.nanmin(values)),
+        thr_max=float(np.nanmax(values)),
+        unit=unit,
+        count=len(values),
+        nan_count=int(np.count_nonzero(np.isnan(values))),
+    )
+
+
+def _getFitsStatistics(
+    path: str,
+) -> Tuple[Dict[str, VariableStatisticsBase], Dict[str, Histogram]]:
+
+    # Single streaming pass over the cube, the point table is never built
+    cube = handle_cache.observation(path, use_dask=True)
+    n_chan = cube.shape[0]
+
+    ra_plane, dec_plane = handle_cache.array(
+        path, "celestial_plane", lambda: fits_celestial_plane(cube)
+    )
+    plane_valid = np.isfinite(ra_plane) & np.isfinite(dec_plane)
+
+    # Valid voxels per pixel and per channel weight the coordinate histograms
+    pixel_count = np.zeros(len(plane_valid), dtype=np.int64)
+    channel_count = np.zeros(n_chan, dtype=np.int64)
+    intensity_min, intensity_max = np.inf, -np.inf
+    intensity_histograms = []
+
+    for start, stop, data in iter_fits_slabs(cube):
+        valid = np.isfinite(data) & plane_valid
+        pixel_count += valid.sum(axis=0)
+        channel_count[start:stop] = valid.sum(axis=1)
+        if valid.any():
+            values = data[valid]
+            intensity_min = min(intensity_min, float(values.min()))
+            intensity_max = max(intensity_max, float(values.max()))
+            intensity_histograms.append(histogram(values))
+
+    # Coordinates only span the pixels and channels that hold valid voxels
+    pixel_valid = pixel_count > 0
+    channel_valid = channel_count > 0
+    ra, dec = ra_plane[pixel_valid], dec_plane[pixel_valid]
+    spectral_axis = cube.spectral_axis.value
+    velocity = spectral_axis[channel_valid]
+    count = int(channel_count.sum())
+    nan_count = n_chan * len(plane_valid) - count
+
+    del cube
+
+    # A cube without valid voxels has no range, its thresholds are NaN
+    def bounds(values):
+        return (values.min(), values.max()) if len(values) else (np.nan, np.nan)
+
+    if not intensity_histograms:
+        intensity_min = intensity_max = np.nan
+
+    def stats(var_name, thr_min, thr_max, unit, nan_count=0):
+        return VariableStatisticsBase(
+            var_name=var_name,
+            thr_min=float(thr_min),
+            thr_max=float(thr_max),
+            unit=unit,
+            count=count,
+            nan_count=nan_count,
+        )
 
-    res = {}
+    statistics = {
+        "ra": stats("ra", *bounds(ra), "deg"),
+        "dec": stats("dec", *bounds(dec), "deg"),
+        "velocity": stats("velocity", *bounds(velocity), "m / s"),
+        "intensity": stats(
+            "intensity", intensity_min, intensity_max, "K", nan_count=nan_count
+        ),
+    }
+    # Slabs are binned over their own range, then merged over the cube's
+    histograms = {
+        "ra": histogram(ra, pixel_count[pixel_valid]),
+        "dec": histogram(dec, pixel_count[pixel_valid]),
+        "velocity": histogram(velocity, channel_count[channel_valid]),
+        "intensity": merge_histograms(intensity_histograms),
+    }
+    return statistics, histograms
+
+
+def getDistributions(
+    path: str, family=None
+) -> Tuple[Dict[str, VariableStatisticsBase], Dict[str, Histogram]]:
+
+    statistics, histograms = {}, {}
 
     if getFileType(path) == "fits":
 
-        cube = fits_to_dataframe(path)
+        statistics, histograms = _getFitsStatistics(path)
 
-        res["ra"] = VariableConfig(
-            thr_min=float(cube["ra"].min()),
-            thr_max=float(cube["ra"].max()),
-            unit="deg",
-        )
-        res["dec"] = VariableConfig(
-            thr_min=float(cube["dec"].min()),
-            thr_max=float(cube["dec"].max()),
-            unit="deg",
-        )
-        res["velocity"] = VariableConfig(
-            thr_min=float(cube["velocity"].min()),
-            thr_max=float(cube["velocity"].max()),
-            unit="m / s",
-        )
-        res["intensity"] = VariableConfig(
-            thr_min=float(cube["intensity"].min()),
-            thr_max=float(cube["intensity"].max()),
-            unit="K",
-        )
+    else:
+        with handle_cache.simulation(path, family) as sim:
+            sim.physical_units()
 
-        del cube
+            keys = ["x", "y", "z"] + sim.loadable_keys()
+            keys.remove("pos")
 
-    else:
-        sim = loadSimulation(path, family)
-        sim.physical_units()
-
-        keys = ["x", "y", "z"] + sim.loadable_keys()
-        keys.remove("pos")
-
-        for key in keys:
-            if sim[key].ndim > 1:
-                for i in range(sim[key].shape[1]):
-                    res[f"{key}-{i}"] = VariableConfigRead(
-                        thr_min=float(sim[key][:, i].min()),
-                        thr_max=float(sim[key][:, i].max()),
-                        unit=str(sim[key].units),
-                    )
-            else:
-                res[key] = VariableConfigRead(
-                    thr_min=float(sim[key].min()),
-                    thr_max=float(sim[key].max()),
-                    unit=str(sim[key].units),
-                )
-
-        del sim
-
-    return res
+            for key in keys:
+                unit = str(sim[key].units)
+                if sim[key].ndim > 1:
+                    columns = [
+                        (f"{key}-{i}", sim[key][:, i]) for i in range(sim[key].shape[1])
+                    ]
+                else:
+                    columns = [(key, sim[key])]
+                for name, values in columns:
+                    values = values.view(np.ndarray)
+                    statistics[name] = _getVariableStatistics(name, values, unit)
+                    histograms[name] = histogram(values)
+
+    return statistics, histograms
+
+
+def getStatistics(path: str, family=None) -> Dict[str, VariableStatisticsBase]:
+
+    return getDistributions(path, family)[0]
+
+
+def getThresholds(path: str, family=None) -> Dict[str, VariableConfigRead]:
+
+    return {
+        key: VariableConfigRead(
+            thr_min=stats.thr_min, thr_max=stats.thr_max, unit=stats.unit
+        )
+        for key, stats in getStatistics(path, family).items()
+    }
@@ -0,0 +1,166 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+import numpy as np
+
+from api.metrics import measure
+from src.loaders import loadObservation, loadSimulation
+
+HANDLE_CACHE_BYTES = int(os.getenv("HANDLE_CACHE_BYTES", 2 * 1024**3))
+
+
+def _simulation_bytes(sim) -> int:
+    # Arrays loaded so far, views (x, y, z of pos...) share their parent's memory
+    snap = sim.ancestor
+    arrays = [snap[key] for key in snap.keys()]
+    for family in snap.families():
+        arrays += [snap[family][key] for key in snap.family_keys(family)]
+    buffers = {}
+    for array in arrays:
+        while isinstance(array.base, np.ndarray):
+            array = array.base
+        buffers[id(array)] = array.nbytes
+    return sum(buffers.values())
+
+
+def _array_bytes(value) -> int:
+    if isinstance(value, tuple):
+        return sum(_array_bytes(item) for item in value)
+    return getattr(value, "nbytes", 0)
+
+
+class _Entry:
+    def __init__(self, value: Any, sizeof: Callable[[Any], int]):
+        self.value = value
+        self.sizeof = sizeof
+        self.size = 0
+        # Handles load lazily and are not thread safe, users hold this lock
+        self.lock = threading.RLock()
+
+
+class HandleCache:
+    """Opened simulations, cubes and derived arrays shared by the whole process
+
+    Entries are keyed by path, size and mtime so a modified file is reopened.
+    Simulation sizes grow as pynbody loads arrays, they are measured again on
+    every eviction; least recently used entries go first.
+    """
+
+    def __init__(self, max_bytes: int = HANDLE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple, _Entry]" = OrderedDict()
+        self._loading: Dict[Tuple, threading.Lock] = {}
+
+    @contextmanager
+    def simulation(self, path: str, family=None) -> Iterator[Any]:
+        entry = self._get(
+            ("simulation", family), path, lambda: loadSimulation(path, family), "open"
+        )
+        with entry.lock:
+            yield entry.value
+        self._evict()
+
+    def observation(self, path: str, use_dask: bool = False) -> Any:
+        # Cubes are only read once opened, they are shared without locking
+        entry = self._get(
+            ("observation", use_dask),
+            path,
+            lambda: loadObservation(path, use_dask=use_dask),
+            "open",
+            sizeof=lambda cube: 0 if use_dask else cube._data.nbytes,
+        )
+        self._evict()
+        return entry.value
+
+    def array(self, path: str, name: str, compute: Callable[[], Any]) -> Any:
+        # Arrays (or tuples of arrays) derived from a file, computed once
+        entry = self._get(("array", name), path, compute, name, sizeof=_array_bytes)
+        self._evict()
+        return entry.value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._size(),
+                "max_bytes": self.max_bytes,
+            }
+
+    def _get(
+        self,
+        kind: Tuple,
+        path: str,
+        load: Callable[[], Any],
+        stage: str,
+        sizeof: Optional[Callable[[Any], int]] = None,
+    ) -> _Entry:
+        stat = os.stat(path)
+        key = (*kind, path, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            loading = self._loading.setdefault(key, threading.Lock())
+
+        # Only one thread opens a given file, the others wait for its handle
+        with loading:
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is not None:
+                return entry
+            try:
+                with measure(stage):
+                    value = load()
+                entry = _Entry(value, sizeof or _simulation_bytes)
+            except BaseException:
+                with self._lock:
+                    self._loading.pop(key, None)
+                raise
+            with self._lock:
+                # Handles of older versions of the file are stale
+                for old_key in list(self._entries):
+                    if old_key[:-2] == key[:-2]:
+                        del self._entries[old_key]
+                self._entries[key] = entry
+                self._loading.pop(key, None)
+        return entry
+
+    def _size(self) -> int:
+        return sum(self._sizeof(entry) for entry in self._entries.values())
+
+    def _sizeof(self, entry: _Entry) -> int:
+        # Entries in use by another thread are measured as they were last seen
+        if entry.lock.acquire(blocking=False):
+            try:
+                entry.size = entry.sizeof(entry.value)
+            finally:
+                entry.lock.release()
+        return entry.size
+
+    def _evict(self) -> None:
+        with self._lock:
+            total = self._size()
+            while total > self.max_bytes and self._entries:
+                key, entry = next(iter(self._entries.items()))
+                total -= self._sizeof(entry)
+                del self._entries[key]
+
+
+handle_cache = HandleCache()
@@ -0,0 +1,94 @@
+import os
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Bins of the histograms stored per file, finer than what clients ask for so
+# they can be merged and rebinned with little loss
+HISTOGRAM_BINS = int(os.getenv("HISTOGRAM_BINS", 1024))
+
+# (bin_min, bin_max, counts), counts of equal-width bins between bin_min and bin_max
+Histogram = Tuple[float, float, np.ndarray]
+
+
+def histogram(
+    values: np.ndarray,
+    weights: Optional[np.ndarray] = None,
+    bins: int = HISTOGRAM_BINS,
+) -> Histogram:
+
+    # NaN and infinite values are left out
+    finite = np.isfinite(values)
+    if not finite.all():
+        values = values[finite]
+        weights = weights[finite] if weights is not None else None
+    if len(values) == 0:
+        return 0.0, 0.0, np.zeros(bins, dtype=np.int64)
+
+    lo, hi = float(values.min()), float(values.max())
+    if lo == hi:
+        counts = np.zeros(bins, dtype=np.int64)
+        counts[0] = len(values) if weights is None else weights.sum()
+        return lo, hi, counts
+    counts, _ = np.histogram(values, bins=bins, range=(lo, hi), weights=weights)
+    return lo, hi, counts.astype(np.int64)
+
+
+def _cumulative(hist: Histogram, edges: np.ndarray) -> np.ndarray:
+    # Counts below each edge, spread evenly within the bins of hist
+    lo, hi, counts = hist
+    total = counts.sum()
+    if lo == hi:
+        cumulative = np.where(edges > lo, total, 0).astype(float)
+        cumulative[-1] = total
+        return cumulative
+    source = np.linspace(lo, hi, len(counts) + 1)
+    return np.interp(edges, source, np.concatenate([[0], np.cumsum(counts)]))
+
+
+def merge_histograms(
+    histograms: Iterable[Histogram], bins: int = HISTOGRAM_BINS
+) -> Histogram:
+
+    histograms = [hist for hist in histograms if hist[2].sum() > 0]
+    if not histograms:
+        return 0.0, 0.0, np.zeros(bins, dtype=np.int64)
+
+    lo = min(hist[0] for hist in histograms)
+    hi = max(hist[1] for hist in histograms)
+    if lo == hi:
+        counts = np.zeros(bins, dtype=np.int64)
+        counts[0] = sum(hist[2].sum() for hist in histograms)
+        return lo, hi, counts
+
+    # Rounding the cumulative counts keeps the totals exact
+    edges = np.linspace(lo, hi, bins + 1)
+    cumulative = sum(_cumulative(hist, edges) for hist in histograms)
+    return lo, hi, np.diff(np.round(cumulative)).astype(np.int64)
+
+
+def histogram_edges(hist: Histogram) -> np.ndarray:
+
+    lo, hi, counts = hist
+    return np.linspace(lo, hi, len(counts) + 1)
+
+
+def histogram_percentiles(hist: Histogram, percentiles: List[float]) -> List[float]:
+
+    # Interpolated within bins, exact to a bin width
+    counts = hist[2]
+    total = counts.sum()
+    if total == 0:
+        return [float("nan")] * len(percentiles)
+    cumulative = np.concatenate([[0], np.cumsum(counts)])
+    ranks = np.asarray(percentiles, dtype=float) / 100 * total
+    # Edge closing the first bin that reaches each rank, the 0th percentile
+    # lies in the first bin that is not empty
+    stops = np.where(
+        ranks > 0,
+        np.searchsorted(cumulative, ranks, side="left"),
+        np.searchsorted(cumulative, 0, side="right"),
+    )
+    fractions = (ranks - cumulative[stops - 1]) / counts[stops - 1]
+    edges = histogram_edges(hist)
+    return (edges[stops - 1] + fractions * (edges[stops] - edges[stops - 1])).tolist()
@@ -1,10 +1,18 @@
-import pynbody
-from spectral_cube import SpectralCube
+from typing import TYPE_CHECKING
 
 from src.utils import getFileType
 
+if TYPE_CHECKING:
+    import pynbody
+    from spectral_cube import SpectralCube
 
-def loadSimulation(path: str, family=None) -> pynbody.snapshot.SimSnap:
+# pynbody and spectral_cube (with astropy) take seconds to import, they are
+# imported on first use so the server starts without them
+SCIENCE_MODULES = ["pynbody", "spectral_cube"]
+
+
+def loadSimulation(path: str, family=None) -> "pynbody.snapshot.SimSnap":
+    import pynbody
 
     if family is None:
         sim = pynbody.load(path)
@@ -16,9 +24,11 @@ def loadSimulation(path: str, family=None) -> pynbody.snapshot.SimSnap:
     return sim
 
 
-def loadObservation(path: str) -> SpectralCube:
+def loadObservation(path: str, use_dask: bool = False) -> "SpectralCube":
+    from spectral_cube import SpectralCube
 
-    obs = SpectralCube.read(path)
+    # With use_dask the data stays on disk and is only read slab by slab
+    obs = SpectralCube.read(path, use_dask=use_dask)
 
     return obs
 
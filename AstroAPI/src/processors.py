@@ -1,119 +1,352 @@
+import os
+from typing import Iterator, List, Optional, Tuple
+
 import numpy as np
 import pandas as pd
 
 from api.models import ConfigProcessRead
-from src.loaders import loadObservation, loadSimulation
+from src.handles import handle_cache
 from src.utils import getFileType
 
+# Upper bound on the memory used by one slab of a spectral cube while streaming
+FITS_CHUNK_BYTES = int(os.getenv("FITS_CHUNK_BYTES", 256 * 1024**2))
 
-def fits_to_dataframe(path, config: ConfigProcessRead = None):
-
-    # Load the spectral cube
-    cube = loadObservation(path)
-
-    df_list = []
 
-    # Iterate over the spectral axis (velocity axis)
-    for i in range(cube.shape[0]):
-        # Slice one spectral frame at a time
-        slab = cube[i, :, :]  # shape: (y, x)
+def fits_celestial_plane(cube) -> Tuple[np.ndarray, np.ndarray]:
 
-        # Get world coordinates for this frame
-        world = slab.wcs.pixel_to_world_values(
-            *np.meshgrid(
-                np.arange(cube.shape[2]),  # x (RA)
-                np.arange(cube.shape[1]),  # y (Dec)
-                indexing="xy",
-            )
+    # RA/Dec only depend on the celestial plane, compute them once for all channels
+    n_chan, n_y, n_x = cube.shape
+    ra_plane, dec_plane = cube.wcs.celestial.pixel_to_world_values(
+        *np.meshgrid(
+            np.arange(n_x),  # x (RA)
+            np.arange(n_y),  # y (Dec)
+            indexing="xy",
+        )
+    )
+    return ra_plane.ravel(), dec_plane.ravel()
+
+
+def iter_fits_slabs(
+    cube, chunk_bytes: int = FITS_CHUNK_BYTES
+) -> Iterator[Tuple[int, int, np.ndarray]]:
+
+    n_chan, n_y, n_x = cube.shape
+    # Input slab + mask, voxel/channel/pixel indices and four output columns
+    voxel_bytes = (
+        2 * cube._data.dtype.itemsize
+        + 1
+        + 3 * np.dtype(np.intp).itemsize
+        + 4 * np.dtype(float).itemsize
+    )
+    chunk_channels = max(1, chunk_bytes // (n_y * n_x * voxel_bytes))
+
+    for start in range(0, n_chan, chunk_channels):
+        stop = min(start + chunk_channels, n_chan)
+        # Masked voxels are NaN, each channel is flattened to the celestial plane
+        yield start, stop, cube.filled_data[start:stop].value.reshape(stop - start, -1)
+
+
+def sample_indices(n_rows: int, n_samples: int, rng: np.random.Generator) -> np.ndarray:
+
+    if n_samples >= n_rows:
+        return np.arange(n_rows)
+    # Sorted so that gathers walk the arrays in order
+    return np.sort(rng.choice(n_rows, size=n_samples, replace=False))
+
+
+def iter_fits_chunks(
+    path,
+    chunk_bytes: int = FITS_CHUNK_BYTES,
+    frac: float = 1.0,
+    rng: Optional[np.random.Generator] = None,
+) -> Iterator[pd.DataFrame]:
+
+    # Dask-backed cube: nothing is read until a slab of channels is requested
+    cube = handle_cache.observation(path, use_dask=True)
+    rng = rng if rng is not None else np.random.default_rng()
+
+    ra_plane, dec_plane = handle_cache.array(
+        path, "celestial_plane", lambda: fits_celestial_plane(cube)
+    )
+    plane_valid = np.isfinite(ra_plane) & np.isfinite(dec_plane)
+    velocity_axis = cube.spectral_axis.value
+
+    seen = kept = 0
+    for start, stop, data in iter_fits_slabs(cube, chunk_bytes):
+        # The whole slab is read, only the coordinate columns are built for the
+        # sampled voxels (masked voxels and pixels outside the projection dropped)
+        valid = np.isfinite(data) & plane_valid
+        voxels = np.flatnonzero(valid)
+        del valid
+
+        # Carry the rounding over slabs so the file keeps round(frac * rows) overall
+        seen += len(voxels)
+        n_keep = round(frac * seen) - kept
+        kept += n_keep
+        if n_keep < len(voxels):
+            voxels = voxels[sample_indices(len(voxels), n_keep, rng)]
+
+        channel, pixel = np.divmod(voxels, data.shape[1])
+
+        yield pd.DataFrame(
+            {
+                "velocity": velocity_axis[start + channel],
+                "ra": ra_plane[pixel],
+                "dec": dec_plane[pixel],
+                "intensity": data.ravel()[voxels],
+            },
+            copy=False,
         )
 
-        ra = world[0].flatten()
-        dec = world[1].flatten()
-        velo = cube.spectral_axis[i].value  # Single velocity value for this slice
-        intensity = slab.filled_data[:].value.flatten()
+    del cube
 
-        # Build DataFrame for this slab
-        df_slice = pd.DataFrame(
-            {"velocity": velo, "ra": ra, "dec": dec, "intensity": intensity}
-        )
 
-        df_list.append(df_slice)
+def fits_to_dataframe(path, config: ConfigProcessRead = None):
 
-    # Concatenate all slices into a single DataFrame
-    df = pd.concat(df_list, ignore_index=True)
-    df.dropna(inplace=True)
-    del cube
     if not config:
-        return df
-    df_sampled = df.sample(frac=config.downsampling)
+        return pd.concat(list(iter_fits_chunks(path)), ignore_index=True)
 
-    return df_sampled
+    chunks = iter_fits_chunks(
+        path,
+        frac=config.downsampling,
+        rng=np.random.default_rng(config.seed),
+    )
+    return pd.concat(list(chunks), ignore_index=True)
 
 
-def pynbody_to_dataframe(path, config: ConfigProcessRead, family=None):
+def pynbody_to_dataframe(
+    path,
+    config: ConfigProcessRead,
+    family=None,
+    frac: Optional[float] = None,
+    rng: Optional[np.random.Generator] = None,
+):
 
-    sim = loadSimulation(path, family)
+    if frac is None:
+        frac = config.downsampling
+    if rng is None:
+        rng = np.random.default_rng(config.seed)
 
-    sim.physical_units()
+    with handle_cache.simulation(path, family) as sim:
+        sim.physical_units()
 
-    data = {}
+        # pynbody has no partial reads: each selected array is loaded in full and
+        # stays in the handle cache, only the copies made here are downsampled
+        indices = sample_indices(len(sim), round(frac * len(sim)), rng)
 
-    for key, value in config.variables.items():
-        if value.selected:
-            if "-" in key:
-                key, i = key.split("-")
-                data[f"{key}-{i}"] = sim[key][:, int(i)].astype(float)
+        data = {}
 
-            else:
-                data[key] = sim[key].astype(float)
+        for key, value in config.variables.items():
+            if value.selected:
+                if "-" in key:
+                    key, i = key.split("-")
+                    data[f"{key}-{i}"] = np.asarray(
+                        sim[key][indices, int(i)], dtype=float
+                    )
 
-    df = pd.DataFrame(data)
+                else:
+                    data[key] = np.asarray(sim[key][indices], dtype=float)
 
-    df_sampled = df.sample(frac=config.downsampling)
+        # Particle ids are needed to deduplicate across snapshots, even if unselected
+        if config.deduplicate == "iord" and "iord" not in data:
+            data["iord"] = np.asarray(sim["iord"][indices])
 
-    del sim
+    df = pd.DataFrame(data)
 
-    return df_sampled
+    return df
 
 
-def filter_dataframe(df: pd.DataFrame, config: ConfigProcessRead) -> pd.DataFrame:
-    filtered_df = df.copy()
+def compile_filters(
+    config: ConfigProcessRead, columns: List[str]
+) -> Tuple[List[Tuple[str, float, float]], List[Tuple[str, float, float]]]:
 
+    # Positions drop the rows outside their thresholds, any other variable is
+    # set to 0 outside of them
+    row_filters, clamps = [], []
     for var_name, var_config in config.variables.items():
-
-        if var_config.selected:
+        if var_config.selected and var_name in columns:
+            bounds = (var_name, var_config.thr_min_sel, var_config.thr_max_sel)
             if var_name in ["x", "y", "z"]:
-                print(
-                    f"Filtering {var_name} with thresholds {var_config.thr_min_sel} and {var_config.thr_max_sel}"
-                )
-                # Filter the DataFrame based on the specified thresholds
-                filtered_df = filtered_df[
-                    (filtered_df[var_name] >= var_config.thr_min_sel)
-                    & (filtered_df[var_name] <= var_config.thr_max_sel)
-                ]
+                row_filters.append(bounds)
             else:
-                print(
-                    f"Setting {var_name} values to 0 if outside thresholds {var_config.thr_min_sel} and {var_config.thr_max_sel}"
-                )
-                filtered_df.loc[
-                    (filtered_df[var_name] < var_config.thr_min_sel)
-                    | (filtered_df[var_name] > var_config.thr_max_sel),
-                    var_name,
-                ] = 0
+                clamps.append(bounds)
+    return row_filters, clamps
 
-    return filtered_df
 
+def filter_dataframe(df: pd.DataFrame, config: ConfigProcessRead) -> pd.DataFrame:
+    # Single pass over the column arrays: one fused row mask, clamps replace
+    # only the columns that have values out of range. The caller's frame and
+    # its column arrays are left untouched.
+    row_filters, clamps = compile_filters(config, df.columns)
+    df = df.copy(deep=False)
+
+    for var_name, thr_min, thr_max in clamps:
+        values = df[var_name].to_numpy()
+        outside = values < thr_min
+        outside |= values > thr_max
+        if outside.any():
+            df[var_name] = np.where(outside, 0, values).astype(values.dtype, copy=False)
+
+    if not row_filters:
+        return df
 
-def convertToDataframe(
-    path, config: ConfigProcessRead, family=None
-) -> pd.DataFrame:  # Maybe needs a better name
-
+    keep = np.ones(len(df), dtype=bool)
+    for var_name, thr_min, thr_max in row_filters:
+        values = df[var_name].to_numpy()
+        keep &= values >= thr_min
+        keep &= values <= thr_max
+    return df if keep.all() else df[keep]
+
+
+def deduplicate(df: pd.DataFrame, config: ConfigProcessRead) -> pd.DataFrame:
+
+    if config.deduplicate == "rows":
+        return df.drop_duplicates(ignore_index=True)
+
+    if config.deduplicate == "iord" and "iord" in df.columns:
+        df = df.drop_duplicates(subset="iord", ignore_index=True)
+        iord = config.variables.get("iord")
+        if not (iord and iord.selected):
+            df = df.drop(columns="iord")
+
+    return df
+
+
+def spatial_columns(columns: List[str], config: ConfigProcessRead) -> List[str]:
+
+    # Axes picked by the user first, otherwise the natural positions of the data
+    axes = [
+        var_name
+        for axis in ["x_axis", "y_axis", "z_axis"]
+        for var_name, var_config in config.variables.items()
+        if getattr(var_config, axis) and var_name in columns
+    ]
+    if axes:
+        return axes
+    for default in (["x", "y", "z"], ["ra", "dec", "velocity"]):
+        axes = [column for column in default if column in columns]
+        if axes:
+            return axes
+    return []
+
+
+def cell_index(df: pd.DataFrame, columns: List[str], cells: int) -> np.ndarray:
+
+    # Flat index of the grid cell holding each point, on a cells^d grid spanning
+    # the bounding box of the points
+    index = np.zeros(len(df), dtype=np.int64)
+    for column in columns:
+        values = df[column].to_numpy()
+        low, high = values.min(), values.max()
+        scale = cells / (high - low) if high > low else 0.0
+        cell = np.minimum(((values - low) * scale).astype(np.int64), cells - 1)
+        index = index * cells + cell
+    return index
+
+
+def decimate(
+    df: pd.DataFrame,
+    config: ConfigProcessRead,
+    rng: Optional[np.random.Generator] = None,
+) -> pd.DataFrame:
+
+    if rng is None:
+        rng = np.random.default_rng(config.seed)
+    target = config.target_points
+    columns = spatial_columns(df.columns, config)
+
+    if config.decimation != "none" and columns and len(df):
+        cells = cell_index(df, columns, config.decimation_cells)
+
+        # Shuffle, then group by cell: the rank of a point inside its cell is random
+        order = rng.permutation(len(df))
+        by_cell = np.argsort(cells[order], kind="stable")
+        sorted_cells = cells[order][by_cell]
+        starts = np.flatnonzero(np.r_[True, sorted_cells[1:] != sorted_cells[:-1]])
+        counts = np.diff(np.r_[starts, len(df)])
+        rank = np.arange(len(df)) - np.repeat(starts, counts)
+
+        if config.decimation == "voxel_grid":
+            cap = 1
+        elif config.decimation_cap is not None:
+            cap = config.decimation_cap
+        elif target is not None:
+            # Smallest per-cell cap that still reaches the target, dense cells
+            # are trimmed first and sparse ones are kept whole
+            low, high = 1, int(counts.max())
+            while low < high:
+                mid = (low + high) // 2
+                if np.minimum(counts, mid).sum() >= target:
+                    high = mid
+                else:
+                    low = mid + 1
+            cap = low
+        else:
+            cap = 1
+
+        keep = np.sort(order[by_cell[rank < cap]])
+        df = df.iloc[keep]
+
+    if target is not None and len(df) > target:
+        df = df.iloc[sample_indices(len(df), target, rng)]
+
+    return df
+
+
+def sample_rows(
+    chunk_rows: List[int], frac: float, rng: np.random.Generator
+) -> np.ndarray:
+
+    # Same draws as the streaming loaders when given the sizes of their chunks,
+    # so loaded data is sampled exactly like the files themselves
+    indices = []
+    seen = kept = offset = 0
+    for rows in chunk_rows:
+        seen += rows
+        n_keep = round(frac * seen) - kept
+        kept += n_keep
+        indices.append(offset + sample_indices(rows, n_keep, rng))
+        offset += rows
+    return np.concatenate(indices) if indices else np.arange(0)
+
+
+def iter_load_chunks(
+    path,
+    config: ConfigProcessRead,
+    family=None,
+    frac: float = 1.0,
+    rng: Optional[np.random.Generator] = None,
+) -> Iterator[pd.DataFrame]:
+
+    # Rows of the selected variables, sampled by frac in the loaders but never
+    # filtered; every row by default
     if getFileType(path) == "fits":
-        df = fits_to_dataframe(
-            path, config
-        )  # When we load an observation since the available data will always be just "x,y,z,intensity" it's meaningless to drop unused axes, we always need all 4
+        yield from iter_fits_chunks(path, frac=frac, rng=rng)
 
     else:
-        df = pynbody_to_dataframe(path, config, family)
+        yield pynbody_to_dataframe(path, config, family, frac=frac, rng=rng)
 
-    return filter_dataframe(df, config)
+
+def iter_dataframe_chunks(
+    path,
+    config: ConfigProcessRead,
+    family=None,
+    frac: Optional[float] = None,
+    rng: Optional[np.random.Generator] = None,
+) -> Iterator[pd.DataFrame]:
+
+    # frac overrides config.downsampling when sampling is allocated across files
+    if frac is None:
+        frac = config.downsampling
+    if rng is None:
+        rng = np.random.default_rng(config.seed)
+
+    if getFileType(path) == "fits":
+        # When we load an observation since the available data will always be just "x,y,z,intensity" it's meaningless to drop unused axes, we always need all 4
+        # Cubes are streamed in slabs: each one is sampled and filtered before the next is read
+        for df in iter_fits_chunks(path, frac=frac, rng=rng):
+            yield filter_dataframe(df, config)
+
+    else:
+        df = pynbody_to_dataframe(path, config, family, frac, rng)
+        yield filter_dataframe(df, config)
@@ -0,0 +1,44 @@
+import os
+import tempfile
+import warnings
+
+import pytest
+
+# Tests never touch the database of a local server
+os.environ.setdefault(
+    "DATABASE_URL", f"sqlite:///{tempfile.mkdtemp(prefix='astroapi-tests-')}/test.db"
+)
+
+from api.models import ConfigProcessRead, VariableConfigRead
+from benchmarks.synthetic import make_cube, make_snapshot
+
+
+@pytest.fixture(scope="session")
+def snapshot(tmp_path_factory) -> str:
+    path = tmp_path_factory.mktemp("data") / "snapshot.hdf5"
+    return make_snapshot(str(path), 5_000)
+
+
+@pytest.fixture(scope="session")
+def cube(tmp_path_factory) -> str:
+    path = tmp_path_factory.mktemp("data") / "cube.fits"
+    return make_cube(str(path), (12, 16, 16))
+
+
+@pytest.fixture
+def snapshot_config() -> ConfigProcessRead:
+    return ConfigProcessRead(
+        downsampling=1.0,
+        variables={
+            name: VariableConfigRead(unit="", selected=True)
+            for name in ["x", "y", "z", "rho"]
+        },
+    )
+
+
+@pytest.fixture(autouse=True)
+def quiet_loaders():
+    # The synthetic snapshots have no unit information
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        yield
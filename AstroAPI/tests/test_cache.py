@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from api.cache import ResultCache
+from api.models import ConfigProcessRead, VariableConfigRead
+
+
+@pytest.fixture
+def cache(tmp_path) -> ResultCache:
+    return ResultCache(str(tmp_path / "cache"))
+
+
+@pytest.fixture
+def paths(tmp_path):
+    path = tmp_path / "snapshot.hdf5"
+    path.write_bytes(b"snapshot")
+    return [str(path)]
+
+
+def config(**kwargs) -> ConfigProcessRead:
+    return ConfigProcessRead(
+        variables={
+            name: VariableConfigRead(unit="", selected=True)
+            for name in ["x", "y", "z", "rho"]
+        },
+        **{"downsampling": 1.0, **kwargs},
+    )
+
+
+def test_axis_flags_change_the_key_of_decimated_results(cache, paths):
+    base = config(decimation="voxel_grid", decimation_cells=4)
+    moved = base.model_copy(deep=True)
+    moved.variables["rho"].x_axis = True
+
+    assert cache.key(paths, base) != cache.key(paths, moved)
+
+
+def test_axis_flags_are_ignored_without_decimation(cache, paths):
+    base = config()
+    moved = base.model_copy(deep=True)
+    moved.variables["rho"].x_axis = True
+
+    assert cache.key(paths, base) == cache.key(paths, moved)
+
+
+def test_key_ignores_what_does_not_change_the_result(cache, paths):
+    base = config()
+    base.variables["mass"] = VariableConfigRead(unit="", thr_min_sel=0)
+    changed = base.model_copy(deep=True)
+    changed.variables["mass"].thr_min_sel = 5
+    changed.variables["rho"].unit = "g cm**-3"
+    changed.variables["rho"].thr_min = -1
+
+    assert cache.key(paths, base) == cache.key(paths, changed)
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        {"downsampling": 0.5},
+        {"seed": 1},
+        {"deduplicate": "rows"},
+        {"decimation": "voxel_grid"},
+        {"target_points": 10},
+    ],
+)
+def test_key_follows_the_config(cache, paths, change):
+    assert cache.key(paths, config()) != cache.key(paths, config(**change))
+
+
+def test_key_follows_selected_thresholds(cache, paths):
+    base = config()
+    changed = base.model_copy(deep=True)
+    changed.variables["rho"].thr_max_sel = 2
+
+    assert cache.key(paths, base) != cache.key(paths, changed)
+
+
+def test_key_follows_the_files(cache, paths, tmp_path):
+    before = cache.key(paths, config())
+    with open(paths[0], "ab") as f:
+        f.write(b" v2")
+
+    assert cache.key(paths, config()) != before
+
+
+def test_put_and_get(cache, paths):
+    df = pd.DataFrame({"x": np.arange(10.0)})
+    key = cache.key(paths, config())
+
+    assert cache.get(key) is None
+    cache.put(key, paths, df)
+
+    pd.testing.assert_frame_equal(cache.get(key), df, check_index_type=False)
+    assert cache.stats()["entries"] == 1
+
+
+def test_results_of_older_files_are_removed(cache, paths):
+    df = pd.DataFrame({"x": np.arange(10.0)})
+    old_key = cache.key(paths, config())
+    cache.put(old_key, paths, df)
+    with open(paths[0], "ab") as f:
+        f.write(b" v2")
+
+    cache.put(cache.key(paths, config()), paths, df)
+
+    assert cache.get(old_key) is None
+    assert cache.stats()["entries"] == 1
@@ -0,0 +1,79 @@
+import pytest
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from api.crud import crud_config_process
+from api.models import ConfigFileLink, ConfigProcess, ConfigProcessCreate, File
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+def add_files(db: Session, paths):
+    files = {path: File(path=path) for path in paths}
+    db.add_all(files.values())
+    db.commit()
+    return files
+
+
+def configs(paths, variables):
+    return {
+        path: {
+            name: ConfigProcessCreate(var_name=name, unit="")
+            for name in variables[path]
+        }
+        for path in paths
+    }
+
+
+def links(db: Session, project_id: int):
+    rows = db.exec(
+        select(ConfigProcess.var_name, File.path)
+        .join(ConfigFileLink, ConfigFileLink.config_id == ConfigProcess.id)
+        .join(File, File.id == ConfigFileLink.file_id)
+        .where(ConfigProcess.project_id == project_id)
+    ).all()
+    return sorted(rows)
+
+
+def test_configs_are_linked_to_their_files(db):
+    paths = ["a.hdf5", "b.hdf5"]
+    variables = {"a.hdf5": ["x", "y", "rho"], "b.hdf5": ["x", "mass"]}
+    files = add_files(db, paths)
+
+    crud_config_process.create_config_processes(db, 1, configs(paths, variables), files)
+    db.commit()
+
+    expected = sorted((name, path) for path in paths for name in variables[path])
+    assert links(db, 1) == expected
+
+
+def test_ids_follow_insertion_order_between_projects(db):
+    # Project 1 is recreated after project 2: its ids are no longer contiguous
+    # with the first ones and come after those of project 2
+    paths = ["a.hdf5", "b.hdf5"]
+    files = add_files(db, paths)
+    first = {"a.hdf5": ["x"], "b.hdf5": ["y", "z"]}
+    second = {"a.hdf5": ["rho", "mass"], "b.hdf5": ["u"]}
+
+    crud_config_process.create_config_processes(db, 1, configs(paths, first), files)
+    crud_config_process.create_config_processes(db, 2, configs(paths, second), files)
+    crud_config_process.delete_config_process(db, 1)
+    crud_config_process.create_config_processes(
+        db, 1, configs(paths[::-1], first), files
+    )
+    db.commit()
+
+    assert links(db, 1) == [("x", "a.hdf5"), ("y", "b.hdf5"), ("z", "b.hdf5")]
+    assert links(db, 2) == [("mass", "a.hdf5"), ("rho", "a.hdf5"), ("u", "b.hdf5")]
+
+
+def test_no_configs(db):
+    crud_config_process.create_config_processes(db, 1, {}, {})
+    db.commit()
+
+    assert db.exec(select(ConfigProcess)).all() == []
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from api.models import ConfigProcessRead, VariableConfigRead
+from src.processors import cell_index, decimate
+
+
+def config(**kwargs) -> ConfigProcessRead:
+    return ConfigProcessRead(
+        variables={
+            name: VariableConfigRead(unit="", selected=True)
+            for name in ["x", "y", "z", "rho"]
+        },
+        **{"downsampling": 1.0, "seed": 0, **kwargs},
+    )
+
+
+@pytest.fixture
+def points() -> pd.DataFrame:
+    # A dense clump in a sparse background
+    rng = np.random.default_rng(0)
+    positions = np.concatenate(
+        [rng.uniform(0, 1, (2_000, 3)), rng.normal(0.5, 0.02, (8_000, 3))]
+    )
+    df = pd.DataFrame(positions, columns=["x", "y", "z"])
+    df["rho"] = rng.lognormal(0, 1, len(df))
+    return df
+
+
+def per_cell(df: pd.DataFrame, reference: pd.DataFrame, cells: int) -> np.ndarray:
+    # Points per cell of the grid spanning the reference points
+    grid = cell_index(pd.concat([reference, df]), ["x", "y", "z"], cells)
+    return np.bincount(grid[len(reference) :], minlength=cells**3)
+
+
+def test_voxel_grid_keeps_one_point_per_cell(points):
+    decimated = decimate(points, config(decimation="voxel_grid", decimation_cells=8))
+
+    counts = per_cell(decimated, points, 8)
+    assert counts.max() == 1
+    assert (counts > 0).sum() == (per_cell(points, points, 8) > 0).sum()
+
+
+def test_density_cap(points):
+    decimated = decimate(
+        points, config(decimation="density_cap", decimation_cells=8, decimation_cap=5)
+    )
+
+    expected = np.minimum(per_cell(points, points, 8), 5)
+    np.testing.assert_array_equal(per_cell(decimated, points, 8), expected)
+
+
+def test_target_search_picks_the_smallest_cap(points):
+    target = 3_000
+    decimated = decimate(
+        points,
+        config(decimation="density_cap", decimation_cells=8, target_points=target),
+    )
+
+    counts = per_cell(points, points, 8)
+    cap = per_cell(decimated, points, 8).max()
+    assert np.minimum(counts, cap).sum() >= target
+    assert np.minimum(counts, cap - 1).sum() < target
+    # The target bounds the result, sparse cells are kept whole
+    assert len(decimated) == target
+
+
+def test_target_bounds_the_result_without_decimation(points):
+    decimated = decimate(points, config(target_points=1_000))
+
+    assert len(decimated) == 1_000
+    assert decimated.index.is_monotonic_increasing
+
+
+def test_rows_are_kept_whole(points):
+    decimated = decimate(points, config(decimation="voxel_grid", decimation_cells=4))
+
+    pd.testing.assert_frame_equal(decimated, points.loc[decimated.index])
+
+
+def test_decimation_follows_the_seed(points):
+    first = decimate(points, config(decimation="voxel_grid", decimation_cells=8))
+    again = decimate(points, config(decimation="voxel_grid", decimation_cells=8))
+    other = decimate(
+        points, config(decimation="voxel_grid", decimation_cells=8, seed=1)
+    )
+
+    pd.testing.assert_frame_equal(first, again)
+    assert not first.index.equals(other.index)
+
+
+def test_axis_flags_pick_the_grid(points):
+    flagged = config(decimation="voxel_grid", decimation_cells=4)
+    flagged.variables["rho"].x_axis = True
+
+    decimated = decimate(points, flagged)
+
+    assert len(decimated) == 4
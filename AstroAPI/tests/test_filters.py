@@ -0,0 +1,91 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from api.models import ConfigProcessRead, VariableConfigRead
+from src.processors import filter_dataframe
+
+COLUMNS = ["x", "y", "z", "rho", "mass", "temp"]
+
+
+def reference_filter(df: pd.DataFrame, config: ConfigProcessRead) -> pd.DataFrame:
+    # One variable at a time on a copy of the frame, as the filters were first
+    # written: positions drop rows, other variables are set to 0
+    filtered = df.copy()
+    for var_name, var_config in config.variables.items():
+        if not var_config.selected:
+            continue
+        low, high = var_config.thr_min_sel, var_config.thr_max_sel
+        if var_name in ["x", "y", "z"]:
+            filtered = filtered[
+                (filtered[var_name] >= low) & (filtered[var_name] <= high)
+            ]
+        else:
+            filtered.loc[
+                (filtered[var_name] < low) | (filtered[var_name] > high), var_name
+            ] = 0
+    return filtered
+
+
+def random_case(rng: np.random.Generator):
+    rows = int(rng.integers(0, 200))
+    columns = [c for c in COLUMNS if rng.random() < 0.8] or ["x"]
+    df = pd.DataFrame(
+        {
+            column: rng.normal(0, 1, rows).astype(rng.choice([np.float32, np.float64]))
+            for column in columns
+        }
+    )
+    for column in columns:
+        df.loc[rng.random(rows) < 0.1, column] = np.nan
+
+    variables = {}
+    for column in columns:
+        low, high = np.sort(rng.normal(0, 1, 2))
+        if rng.random() < 0.2:
+            low = -np.inf
+        if rng.random() < 0.2:
+            high = np.inf
+        variables[column] = VariableConfigRead(
+            unit="",
+            selected=bool(rng.random() < 0.7),
+            thr_min_sel=float(low),
+            thr_max_sel=float(high),
+        )
+    return df, ConfigProcessRead(downsampling=1.0, variables=variables)
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_matches_reference_filter(seed):
+    df, config = random_case(np.random.default_rng(seed))
+    original = df.copy()
+
+    filtered = filter_dataframe(df, config)
+
+    pd.testing.assert_frame_equal(filtered, reference_filter(df, config))
+    # The caller's frame is left untouched
+    pd.testing.assert_frame_equal(df, original)
+
+
+def test_slices_are_filtered_without_warnings():
+    df = pd.DataFrame({"x": np.arange(10.0), "rho": np.arange(10.0)})
+    config = ConfigProcessRead(
+        downsampling=1.0,
+        variables={
+            "x": VariableConfigRead(
+                unit="", selected=True, thr_min_sel=2, thr_max_sel=8
+            ),
+            "rho": VariableConfigRead(
+                unit="", selected=True, thr_min_sel=4, thr_max_sel=6
+            ),
+        },
+    )
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        filtered = filter_dataframe(df[df["x"] > 1], config)
+
+    assert filtered["x"].tolist() == [2, 3, 4, 5, 6, 7, 8]
+    assert filtered["rho"].tolist() == [0, 0, 4, 5, 6, 0, 0]
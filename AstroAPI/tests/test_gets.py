@@ -0,0 +1,31 @@
+import math
+
+import numpy as np
+from astropy.io import fits
+
+from benchmarks.synthetic import make_cube
+from src import processors
+from src.gets import getDistributions
+
+
+def test_fits_statistics_match_the_point_table(cube):
+    df = processors.fits_to_dataframe(cube)
+    statistics, histograms = getDistributions(cube)
+    for name in ["ra", "dec", "velocity", "intensity"]:
+        assert statistics[name].thr_min == df[name].min()
+        assert statistics[name].thr_max == df[name].max()
+        assert statistics[name].count == len(df)
+        assert histograms[name][2].sum() == len(df)
+
+
+def test_fits_statistics_of_a_blank_cube(tmp_path):
+    path = make_cube(str(tmp_path / "blank.fits"), (4, 6, 6))
+    with fits.open(path, mode="update") as hdul:
+        hdul[0].data[:] = np.nan
+
+    statistics, histograms = getDistributions(path)
+    for name, stats in statistics.items():
+        assert math.isnan(stats.thr_min) and math.isnan(stats.thr_max)
+        assert stats.count == 0
+        assert histograms[name][2].sum() == 0
+    assert statistics["intensity"].nan_count == 4 * 6 * 6
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from src.histograms import (
+    histogram,
+    histogram_edges,
+    histogram_percentiles,
+    merge_histograms,
+)
+
+
+@pytest.fixture
+def values() -> np.ndarray:
+    return np.random.default_rng(0).lognormal(0, 1, 100_000)
+
+
+def test_histogram_skips_non_finite_values():
+    lo, hi, counts = histogram(np.array([1.0, np.nan, 3.0, np.inf, 2.0]), bins=4)
+
+    assert (lo, hi) == (1.0, 3.0)
+    assert counts.sum() == 3
+
+
+def test_histogram_of_constant_values():
+    lo, hi, counts = histogram(np.full(10, 5.0), bins=8)
+
+    assert (lo, hi) == (5.0, 5.0)
+    assert counts[0] == 10 and counts[1:].sum() == 0
+
+
+def test_histogram_weights():
+    _, _, counts = histogram(np.array([0.0, 1.0]), weights=np.array([3, 2]), bins=2)
+
+    assert counts.tolist() == [3, 2]
+
+
+def test_merge_keeps_totals_and_range(values):
+    parts = np.array_split(values, 5)
+    merged = merge_histograms([histogram(part) for part in parts])
+
+    assert merged[0] == values.min()
+    assert merged[1] == values.max()
+    assert merged[2].sum() == len(values)
+
+
+def test_merge_matches_single_histogram(values):
+    # Every part spans a different range, rebinning spreads counts within bins
+    parts = np.array_split(np.sort(values), 4)
+    merged = merge_histograms([histogram(part) for part in parts], bins=64)
+    direct = histogram(values, bins=64)
+
+    np.testing.assert_allclose(merged[:2], direct[:2])
+    assert np.abs(merged[2] - direct[2]).sum() <= 0.01 * len(values)
+
+
+def test_merge_skips_empty_histograms(values):
+    empty = histogram(np.array([]))
+    merged = merge_histograms([empty, histogram(values), empty])
+
+    assert merged[2].sum() == len(values)
+    assert merge_histograms([empty])[2].sum() == 0
+
+
+def test_merge_of_constant_histograms():
+    merged = merge_histograms([histogram(np.full(3, 2.0)), histogram(np.full(4, 2.0))])
+
+    assert merged[:2] == (2.0, 2.0)
+    assert merged[2].sum() == 7
+
+
+def test_percentiles_within_a_bin(values):
+    hist = histogram(values)
+    bin_width = np.diff(histogram_edges(hist))[0]
+    percentiles = [0, 1, 25, 50, 75, 99, 100]
+
+    np.testing.assert_allclose(
+        histogram_percentiles(hist, percentiles),
+        np.percentile(values, percentiles),
+        atol=bin_width,
+    )
+
+
+def test_percentiles_of_merged_histograms(values):
+    merged = merge_histograms(histogram(part) for part in np.array_split(values, 3))
+    bin_width = np.diff(histogram_edges(merged))[0]
+
+    np.testing.assert_allclose(
+        histogram_percentiles(merged, [10, 50, 90]),
+        np.percentile(values, [10, 50, 90]),
+        atol=2 * bin_width,
+    )
+
+
+def test_percentiles_of_empty_histogram():
+    assert np.isnan(histogram_percentiles(histogram(np.array([])), [50])).all()
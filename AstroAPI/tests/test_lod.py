@@ -0,0 +1,38 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from api.lod import LODStore
+
+
+def points(rows: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(rng.uniform(0, 1, (rows, 3)), columns=["x", "y", "z"])
+
+
+def test_levels_end_with_every_point(tmp_path):
+    store = LODStore(str(tmp_path), points_per_node=100)
+    df = points(5_000, 0)
+
+    meta = store.build("a", df, ["x", "y", "z"], np.random.default_rng(0))
+
+    assert meta["levels"][0]["points"] == 100
+    assert meta["levels"][-1]["points"] == len(df)
+    last = store.read_level("a", len(meta["levels"]) - 1)
+    assert np.isclose(np.sort(last["x"]), np.sort(df["x"])).all()
+
+
+def test_least_recently_read_pyramid_is_evicted(tmp_path):
+    store = LODStore(str(tmp_path), points_per_node=100)
+    store.build("a", points(1_000, 0), ["x", "y", "z"])
+    store.build("b", points(1_000, 1), ["x", "y", "z"])
+    store.max_bytes = store.meta("a")["bytes"] + store.meta("b")["bytes"]
+    for key in ["a", "b"]:
+        os.utime(os.path.join(tmp_path, key, "meta.json"), (0, 0))
+    assert store.read_level("a", 0) is not None
+
+    store.build("c", points(1_000, 2), ["x", "y", "z"])
+
+    assert sorted(os.listdir(tmp_path)) == ["a", "c"]
+    assert store.read_level("b", 0) is None
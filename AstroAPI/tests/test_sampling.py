@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import processors
+
+# Small slabs so the cube is read in several chunks
+CHUNK_BYTES = 16 * 16 * 64
+
+
+@pytest.mark.parametrize("frac", [0.1, 0.37, 0.5, 1.0])
+def test_sample_rows_replays_pynbody_draws(snapshot, snapshot_config, frac):
+    sampled = processors.pynbody_to_dataframe(
+        snapshot, snapshot_config, frac=frac, rng=np.random.default_rng(7)
+    )
+
+    loaded = pd.concat(
+        list(processors.iter_load_chunks(snapshot, snapshot_config)),
+        ignore_index=True,
+    )
+    rows = processors.sample_rows([len(loaded)], frac, np.random.default_rng(7))
+
+    assert len(sampled) == round(frac * len(loaded))
+    pd.testing.assert_frame_equal(sampled, loaded.iloc[rows].reset_index(drop=True))
+
+
+@pytest.mark.parametrize("frac", [0.1, 0.37, 0.5, 1.0])
+def test_sample_rows_replays_fits_draws(cube, frac):
+    sampled = pd.concat(
+        list(
+            processors.iter_fits_chunks(
+                cube, CHUNK_BYTES, frac=frac, rng=np.random.default_rng(7)
+            )
+        ),
+        ignore_index=True,
+    )
+
+    chunks = list(processors.iter_fits_chunks(cube, CHUNK_BYTES))
+    assert len(chunks) > 1
+    loaded = pd.concat(chunks, ignore_index=True)
+    rows = processors.sample_rows(
+        [len(chunk) for chunk in chunks], frac, np.random.default_rng(7)
+    )
+
+    assert len(sampled) == round(frac * len(loaded))
+    pd.testing.assert_frame_equal(sampled, loaded.iloc[rows].reset_index(drop=True))
+
+
+def test_sample_rows_without_chunks():
+    assert len(processors.sample_rows([], 0.5, np.random.default_rng(0))) == 0
@@ -0,0 +1,38 @@
+import msgpack
+import numpy as np
+import pandas as pd
+
+from api.serializers import pack_columns
+
+
+def unpack(payload):
+    data = msgpack.unpackb(payload, raw=False)
+    return {
+        column: np.frombuffer(buffer, dtype)
+        for column, dtype, buffer in zip(data["columns"], data["dtypes"], data["data"])
+    }
+
+
+def test_float_columns_are_float32():
+    df = pd.DataFrame({"x": [0.1, 2.5, -3.0], "rho": np.float32([1, 2, 3])})
+    columns = unpack(pack_columns(df))
+    for name in df.columns:
+        assert columns[name].dtype == np.dtype("<f4")
+        np.testing.assert_allclose(columns[name], df[name], rtol=1e-6)
+
+
+def test_integer_columns_stay_exact():
+    # Ids above 2**24 do not survive a float32 round trip
+    ids = np.array([2**24 + 1, 2**40 + 3, 7], dtype=np.int64)
+    df = pd.DataFrame({"iord": ids, "uid": ids.astype(np.uint32), "x": [1.0, 2.0, 3.0]})
+    columns = unpack(pack_columns(df))
+    assert columns["iord"].dtype == np.dtype("<i8")
+    assert columns["uid"].dtype == np.dtype("<u8")
+    np.testing.assert_array_equal(columns["iord"], ids)
+    np.testing.assert_array_equal(columns["uid"], ids.astype(np.uint32))
+
+
+def test_empty_frame():
+    df = pd.DataFrame({"iord": np.empty(0, np.int64), "x": np.empty(0)})
+    columns = unpack(pack_columns(df))
+    assert [len(values) for values in columns.values()] == [0, 0]
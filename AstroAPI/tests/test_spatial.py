@@ -0,0 +1,127 @@
+import itertools
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from api import spatial
+from api.spatial import SpatialIndex, morton_codes, morton_ranges
+
+
+def codes_in(ranges: np.ndarray) -> set:
+    return {code for start, stop in ranges for code in range(start, stop)}
+
+
+@pytest.mark.parametrize("dims", [1, 2, 3])
+def test_ranges_cover_the_cells_of_the_box(dims):
+    bits = 4
+    rng = np.random.default_rng(dims)
+    for _ in range(20):
+        a, b = rng.integers(0, 2**bits, (2, dims))
+        first, last = np.minimum(a, b), np.maximum(a, b)
+        cells = np.array(
+            list(itertools.product(*[range(f, l + 1) for f, l in zip(first, last)]))
+        )
+
+        ranges = morton_ranges(first, last, bits)
+
+        assert (ranges[1:, 0] > ranges[:-1, 1]).all()
+        assert codes_in(ranges) == set(morton_codes(cells, bits).tolist())
+
+
+def test_ranges_are_bounded(monkeypatch):
+    monkeypatch.setattr(spatial, "MAX_QUERY_RANGES", 64)
+    first, last = np.array([1, 2, 3]), np.array([1000, 900, 800])
+
+    ranges = morton_ranges(first, last, 10)
+
+    assert len(ranges) <= 64
+    cells = np.random.default_rng(0).integers(first, last + 1, (1000, 3))
+    codes = morton_codes(cells, 10)
+    found = np.searchsorted(ranges[:, 0], codes, side="right") - 1
+    assert (found >= 0).all() and (codes < ranges[found, 1]).all()
+
+
+@pytest.fixture
+def index(tmp_path):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "x": rng.normal(0, 1, 20_000),
+            "y": rng.uniform(-5, 5, 20_000),
+            "z": rng.exponential(1, 20_000),
+            "rho": rng.lognormal(0, 1, 20_000),
+        }
+    )
+    source = tmp_path / "snapshot.hdf5"
+    source.write_bytes(b"snapshot")
+    index = SpatialIndex(str(tmp_path / "spatial"))
+    index.build("key", str(source), np.array_split(df, 3), ["x", "y", "z"])
+    return index, df
+
+
+def test_box_queries_match_brute_force(index):
+    index, df = index
+    positions = df[["x", "y", "z"]].to_numpy()
+    rng = np.random.default_rng(1)
+    for _ in range(20):
+        a, b = rng.uniform(-3, 3, (2, 3))
+        box_min, box_max = np.minimum(a, b), np.maximum(a, b)
+
+        found = index.query_box("key", box_min.tolist(), box_max.tolist())
+
+        inside = ((positions >= box_min) & (positions <= box_max)).all(axis=1)
+        assert sorted(found["rho"]) == sorted(df["rho"][inside])
+
+
+def test_sphere_queries_match_brute_force(index):
+    index, df = index
+    positions = df[["x", "y", "z"]].to_numpy()
+
+    found = index.query_sphere("key", [0.5, 1, 1], 1.5)
+
+    inside = ((positions - [0.5, 1, 1]) ** 2).sum(axis=1) <= 1.5**2
+    assert sorted(found["rho"]) == sorted(df["rho"][inside])
+
+
+def test_queries_outside_the_data(index):
+    index, _ = index
+
+    assert len(index.query_box("key", [10, 10, 10], [11, 11, 11])) == 0
+
+
+def test_older_versions_of_a_file_are_evicted(tmp_path):
+    source = tmp_path / "snapshot.hdf5"
+    other = tmp_path / "other.hdf5"
+    other.write_bytes(b"other")
+    df = pd.DataFrame({"x": np.arange(100.0)})
+    index = SpatialIndex(str(tmp_path / "spatial"))
+
+    source.write_bytes(b"v1")
+    index.build(index.key(str(source), ["x"]), str(source), [df], ["x"])
+    index.build(index.key(str(other), ["x"]), str(other), [df], ["x"])
+    old_key = index.key(str(source), ["x"])
+    source.write_bytes(b"version 2")
+    new_key = index.key(str(source), ["x"])
+    index.build(new_key, str(source), [df], ["x"])
+
+    assert index.columns(old_key) is None
+    assert index.columns(new_key) == ["x"]
+    assert index.columns(index.key(str(other), ["x"])) == ["x"]
+
+
+def test_least_recently_queried_index_is_evicted(tmp_path):
+    df = pd.DataFrame({"x": np.arange(1000.0)})
+    index = SpatialIndex(str(tmp_path / "spatial"))
+    for name in ["a", "b", "c"]:
+        (tmp_path / name).write_bytes(name.encode())
+    for name in ["a", "b"]:
+        index.build(name, str(tmp_path / name), [df], ["x"])
+        os.utime(tmp_path / "spatial" / name / "meta.json", (0, 0))
+    index.max_bytes = 2 * index._meta("a")["bytes"]
+    index.query_box("a", [0], [10])
+
+    index.build("c", str(tmp_path / "c"), [df], ["x"])
+
+    assert sorted(os.listdir(tmp_path / "spatial")) == ["a", "c"]
@@ -0,0 +1,143 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from api.cache import result_cache
+from api.db import create_db_and_tables, engine
+from api.models import ConfigProcessRead, VariableConfigRead
+from api.stages import rerun_stage
+from api.utils import DataProcessor
+from benchmarks.synthetic import make_snapshot
+from src import processors
+
+
+def config(**kwargs) -> ConfigProcessRead:
+    values = {"downsampling": 0.5, "seed": 3, **kwargs}
+    return ConfigProcessRead(
+        variables={
+            name: VariableConfigRead(
+                unit="",
+                selected=True,
+                thr_min_sel=-float("inf"),
+                thr_max_sel=float("inf"),
+            )
+            for name in ["x", "y", "z", "rho"]
+        },
+        **values,
+    )
+
+
+def with_threshold(base: ConfigProcessRead, x_min: float = 0.0) -> ConfigProcessRead:
+    changed = base.model_copy(deep=True)
+    changed.variables["x"].thr_min_sel = x_min
+    return changed
+
+
+def test_rerun_stage():
+    base = config()
+    unselected = base.model_copy(deep=True)
+    unselected.variables["rho"].selected = False
+
+    assert rerun_stage(None, base) == "load"
+    assert rerun_stage(base, unselected) == "load"
+    assert rerun_stage(base, config(downsampling=0.3)) == "sample"
+    assert rerun_stage(base, with_threshold(base)) == "filter"
+    # The seed is checked against the stored stages
+    assert rerun_stage(base, config(seed=4)) == "filter"
+
+
+@pytest.fixture(scope="module")
+def workdir(tmp_path_factory):
+    # Stages, results and the catalog live under ./data
+    path = tmp_path_factory.mktemp("work")
+    cwd = os.getcwd()
+    os.chdir(path)
+    os.makedirs("data")
+    engine.dispose()
+    create_db_and_tables()
+    yield path
+    engine.dispose()
+    os.chdir(cwd)
+
+
+@pytest.fixture
+def paths(workdir, request):
+    # Files of their own for each test, so that they can be modified
+    return [
+        make_snapshot(str(workdir / f"{request.node.name}_{i}.hdf5"), 3_000, seed=i)
+        for i in range(2)
+    ]
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    # Results are always computed, and every file read is counted
+    monkeypatch.setattr(result_cache, "get", lambda key: None)
+    calls = []
+    iter_load_chunks = processors.iter_load_chunks
+
+    def counted(path, *args, **kwargs):
+        calls.append(path)
+        return iter_load_chunks(path, *args, **kwargs)
+
+    monkeypatch.setattr(processors, "iter_load_chunks", counted)
+    return calls
+
+
+def fresh(pid: int, paths, config: ConfigProcessRead) -> pd.DataFrame:
+    return DataProcessor.process_data(pid, paths, config).copy()
+
+
+def test_threshold_change_only_filters_again(paths, loads):
+    base = config()
+    before = fresh(1, paths, base)
+    x_min = float(before["x"].median())
+    changed = with_threshold(base, x_min)
+    loads.clear()
+
+    reused = DataProcessor.process_data(1, paths, changed, stage="filter")
+
+    assert loads == []
+    pd.testing.assert_frame_equal(reused, fresh(2, paths, changed))
+    assert (reused["x"] >= x_min).all()
+    assert 0 < len(reused) < len(before)
+
+
+def test_downsampling_change_samples_the_loaded_files(paths, loads):
+    fresh(1, paths, config(downsampling=1.0))
+    changed = config(downsampling=0.3)
+    loads.clear()
+
+    reused = DataProcessor.process_data(1, paths, changed, stage="sample")
+
+    assert loads == []
+    pd.testing.assert_frame_equal(reused, fresh(2, paths, changed))
+    assert len(reused) == round(0.3 * 6_000)
+
+
+def test_seed_change_samples_again(paths, loads):
+    base = config()
+    before = fresh(1, paths, base)
+    changed = config(seed=4)
+
+    reused = DataProcessor.process_data(1, paths, changed, stage="filter")
+
+    assert not reused.equals(before)
+    pd.testing.assert_frame_equal(reused, fresh(2, paths, changed))
+
+
+def test_file_change_loads_again(paths, loads):
+    base = config(downsampling=1.0)
+    before = fresh(1, paths, base)
+    # Replaced rather than rewritten, the old version is still open
+    make_snapshot(f"{paths[1]}.new", 3_000, seed=10)
+    os.replace(f"{paths[1]}.new", paths[1])
+    loads.clear()
+
+    reused = DataProcessor.process_data(1, paths, base, stage="filter")
+
+    assert loads == [paths[1]]
+    assert not np.array_equal(reused["x"], before["x"])
+    pd.testing.assert_frame_equal(reused, fresh(2, paths, base))
@@ -0,0 +1,79 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from api.storage import ColumnWriter, read_columns, write_columns
+
+
+def frame(rows: int, start: int = 0) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "x": np.arange(start, start + rows, dtype=np.float64),
+            "intensity": np.linspace(0, 1, rows, dtype=np.float32),
+            "iord": np.arange(start, start + rows, dtype=np.uint64),
+        }
+    )
+
+
+def test_chunks_round_trip(tmp_path):
+    directory = str(tmp_path / "columns")
+    chunks = [frame(10), frame(0, 10), frame(12_345, 10)]
+
+    writer = ColumnWriter(directory)
+    for chunk in chunks:
+        writer.write(chunk)
+    writer.close()
+
+    expected = pd.concat(chunks, ignore_index=True)
+    pd.testing.assert_frame_equal(read_columns(directory, mmap_mode=None), expected)
+    # The patched headers are plain .npy files
+    for column in expected.columns:
+        values = np.load(os.path.join(directory, f"{column}.npy"))
+        assert values.dtype == expected[column].dtype
+        np.testing.assert_array_equal(values, expected[column].to_numpy())
+
+
+def test_chunks_are_cast_to_the_first_dtypes(tmp_path):
+    directory = str(tmp_path / "columns")
+    writer = ColumnWriter(directory)
+    writer.write(frame(3))
+    writer.write(frame(3, 3).astype({"x": np.float32}))
+    writer.close()
+
+    df = read_columns(directory)
+    assert df["x"].dtype == np.float64
+    np.testing.assert_array_equal(df["x"], np.arange(6))
+
+
+def test_close_replaces_previous_directory(tmp_path):
+    directory = str(tmp_path / "columns")
+    write_columns(frame(5), directory)
+    write_columns(frame(2, 100), directory)
+
+    pd.testing.assert_frame_equal(
+        read_columns(directory, mmap_mode=None), frame(2, 100)
+    )
+    assert os.listdir(tmp_path) == ["columns"]
+
+
+def test_discard_keeps_previous_directory(tmp_path):
+    directory = str(tmp_path / "columns")
+    write_columns(frame(5), directory)
+
+    writer = ColumnWriter(directory)
+    writer.write(frame(3, 50))
+    writer.discard()
+
+    pd.testing.assert_frame_equal(read_columns(directory, mmap_mode=None), frame(5))
+    assert os.listdir(tmp_path) == ["columns"]
+
+
+def test_read_selected_columns(tmp_path):
+    directory = str(tmp_path / "columns")
+    write_columns(frame(4), directory)
+
+    assert read_columns(directory, ["iord"]).columns.tolist() == ["iord"]
+    with pytest.raises(KeyError):
+        read_columns(directory, ["missing"])